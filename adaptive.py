@@ -0,0 +1,116 @@
+"""Adaptive subdivision: refine only where the surface needs it.
+
+Every level refines only the faces whose error is above a threshold (the
+largest dihedral angle to a neighbour face by default, or any callback giving one
+value per face). The new vertex points are used around refined faces and the
+edge points of their edges are inserted into the neighbouring faces that are not
+refined, so the result has no T-junctions: Catmull-Clark leaves such faces as
+polygons with more corners and Loop splits them into triangles (red-green
+refinement, triangles with all edges split are refined as well).
+
+How to use it?
+> mesh = CompactMesh.from_file("boxtorus.off")
+> for i in range(5): mesh = subdivision(mesh, "CC", threshold=5)
+or
+> mesh2 = mesh.subdivision_adaptive("LOOP", threshold=5)
+"""
+
+import numpy as np
+
+import off
+from compact import CompactMesh, VERTEX, EDGE, FACE, gather_faces, scatter_add
+
+
+def face_normals(mesh):
+    p = mesh.positions
+    he = mesh.halfedges
+    normals = scatter_add(he.face, np.cross(p[he.origin], p[he.dest]), mesh.face_count)
+    return normals / np.maximum(np.linalg.norm(normals, axis=1), 1e-300)[:, None]
+
+
+def dihedral_angles(mesh):
+    """Largest angle (in degrees) between the normal of every face and the normals of its neighbours."""
+    he = mesh.halfedges
+    normals = face_normals(mesh)
+    inner = np.flatnonzero(he.twin >= 0)
+    twin = he.twin[inner]
+    cos = np.einsum("ij,ij->i", normals[he.face[inner]], normals[he.face[twin]])
+
+    # neighbours with the opposite orientation (same direction of the shared edge) have flipped normals
+    cos = np.where(he.origin[twin] == he.origin[inner], -cos, cos)
+    angles = np.zeros(mesh.face_count)
+    np.maximum.at(angles, he.face[inner], np.degrees(np.arccos(np.clip(cos, -1, 1))))
+    return angles
+
+
+def subdivision(mesh, algorithm="CC", threshold=10, error=None):
+    """One adaptive level of CC or LOOP: faces with error(mesh) > threshold are refined (error is dihedral_angles by default)."""
+    if algorithm not in ("CC", "LOOP"): raise Exception("adaptive subdivision supports only CC and LOOP")
+    errors = np.asarray((error or dihedral_angles)(mesh))
+    return refine(mesh, algorithm, errors > threshold)
+
+
+def refine(mesh, algorithm, selected):
+    """Next level of mesh with only the selected faces (boolean array) refined."""
+    he = mesh.halfedges
+    selected = np.array(selected, dtype=bool)
+    while True:
+        split = np.bincount(he.edge, weights=selected[he.face], minlength=he.edge_count) > 0
+        if algorithm != "LOOP": break
+        full = np.bincount(he.face, weights=split[he.edge], minlength=mesh.face_count) == mesh.face_sizes
+        if not np.any(full & ~selected): break
+        selected |= full
+    if not selected.any(): return mesh
+
+    stencil = getattr(mesh, "stencil_" + algorithm)()
+    if selected.all(): return mesh.refine(stencil)
+
+    # new vertices: all old vertices (moved if they touch a refined face), edge points of
+    # the split edges, face points of the refined faces
+    n = mesh.vertex_count
+    touched = np.bincount(he.origin, weights=selected[he.face], minlength=n) > 0
+    keep = {VERTEX: np.ones(n, dtype=bool), EDGE: split, FACE: selected}
+    kept = np.concatenate([keep[kind] for kind, _ in stencil.blocks])
+    mapping = np.cumsum(kept) - 1
+    moved = np.concatenate([touched if kind == VERTEX else keep[kind] for kind, _ in stencil.blocks])
+    positions = np.empty((np.count_nonzero(kept), 3), dtype=mesh.positions.dtype)
+    positions[:n] = mesh.positions
+    positions[mapping[moved]] = stencil.matrix[np.flatnonzero(moved)].astype(mesh.positions.dtype) @ mesh.positions
+
+    # children of the refined faces
+    children = np.flatnonzero(selected[stencil.face_major])
+    child_indices, child_offsets = gather_faces(stencil.face_indices, stencil.face_offsets, children)
+
+    # other faces with the edge points of their split edges inserted after the corners
+    edge_offset = stencil.block_offset(EDGE)
+    rest = np.flatnonzero(~selected)
+    corners, corner_offsets = gather_faces(np.arange(len(he)), mesh.face_offsets, rest)
+    inserted = split[he.edge[corners]]
+    counts = 1 + inserted
+    polygon = np.empty(counts.sum(), dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    polygon[starts] = he.origin[corners]
+    polygon[starts[inserted] + 1] = mapping[edge_offset + he.edge[corners[inserted]]]
+    polygon_offsets = np.concatenate([[0], np.cumsum(counts)])[corner_offsets]
+
+    if algorithm == "LOOP":
+        # fan from the first inserted point
+        sizes = np.diff(polygon_offsets)
+        face = np.repeat(np.arange(len(rest)), sizes)
+        local = np.arange(len(polygon)) - polygon_offsets[face]
+        is_inserted = np.zeros(len(polygon), dtype=bool)
+        is_inserted[starts[inserted] + 1] = True
+        first = np.full(len(rest), np.iinfo(np.int64).max)
+        np.minimum.at(first, face[is_inserted], local[is_inserted])
+        first = np.where(first == np.iinfo(np.int64).max, 0, first)
+        polygon = polygon[polygon_offsets[face] + (local + first[face]) % sizes[face]]
+        counts = np.maximum(sizes - 2, 1)
+        polygon, polygon_offsets = off.triangulate(polygon, polygon_offsets)
+        rest = np.repeat(rest, counts)
+
+    # every face in place of the face it comes from
+    indices = np.concatenate([mapping[child_indices], polygon])
+    offsets = np.concatenate([child_offsets, child_offsets[-1] + polygon_offsets[1:]])
+    major = np.concatenate([stencil.face_major[children], rest])
+    minor = np.concatenate([stencil.face_minor[children], np.full(len(rest), -1)])
+    return CompactMesh(positions, *gather_faces(indices, offsets, np.lexsort((minor, major))))
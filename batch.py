@@ -0,0 +1,160 @@
+"""Headless batch subdivision of many meshes.
+
+Every input file (globs are expanded) is subdivided by mesh.subdivision in a
+pool of worker processes and saved in the output directory under its path
+relative to the common directory of the inputs. A file that fails doesn't stop
+the others: its error is reported and the run exits with 1. Every result is
+appended to a journal (batch.jsonl in the output directory) as soon as it is
+known, so an interrupted run can be resumed with --resume, which skips the files
+already done with the same parameters. Outputs are written under a temporary
+name and renamed, so an interrupted file never looks done.
+
+How to use it?
+> python batch.py "best_meshes/*.off" --scheme CC --levels 3 --output-dir smooth
+> python batch.py "assets/**/*.off" --scheme LOOP --levels 2 --output-dir out --workers 8 --resume
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+
+import numpy as np
+
+import mesh
+import off
+
+journal_name = "batch.jsonl"
+# options changing an output, recorded with every file (and their values in journals written before they were)
+recorded_options = {"threshold": None, "repair": False, "dtype": "float64", "decimals": None}
+
+
+def expand(patterns):
+    """Files matching the globs, in order and without repetitions."""
+    result = []
+    for pattern in patterns:
+        names = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        result += [name for name in names if name not in result]
+    return result
+
+
+def output_names(inputs, output_dir):
+    """Output file of every input: its path relative to the common directory of all inputs, inside output_dir."""
+    inputs = [os.path.abspath(name) for name in inputs]
+    root = os.path.commonpath([os.path.dirname(name) for name in inputs]) if inputs else ""
+    return [os.path.join(output_dir, os.path.relpath(name, root)) for name in inputs]
+
+
+def parameters(scheme, levels, options):
+    """Everything of a job that changes its output, as stored in the journal."""
+    result = {"scheme": scheme, "levels": levels}
+    result.update({name: options.get(name, default) for name, default in recorded_options.items()})
+    result["dtype"] = np.dtype(result["dtype"]).name
+    return result
+
+
+def process(filename_input, filename_output, levels, scheme, options):
+    """Record of one job (run in a worker process)."""
+    start = time.perf_counter()
+    record = {"input": filename_input, "output": filename_output, **parameters(scheme, levels, options)}
+    directory, name = os.path.split(filename_output)
+    temporary = os.path.join(directory, f".{name}.{os.getpid()}.partial.{name.split('.')[-1]}")
+    try:
+        os.makedirs(directory or ".", exist_ok=True)
+        mesh.subdivision(filename_input, temporary, levels, scheme, **options)
+        # the creases of the result are saved next to it
+        if os.path.exists(off.creases_filename(temporary)): os.replace(off.creases_filename(temporary), off.creases_filename(filename_output))
+        os.replace(temporary, filename_output)
+        record["status"] = "done"
+    except Exception as e:
+        if os.path.exists(temporary): os.remove(temporary)
+        record.update(status="error", error=type(e).__name__, message=str(e), traceback=traceback.format_exc())
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def finished(journal, parameters):
+    """Inputs done by earlier runs with the same parameters (see parameters(), and whose outputs still exist)."""
+    done = set()
+    if not os.path.exists(journal): return done
+    with open(journal) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a run killed while writing it
+                continue
+            same = all(record.get(name, recorded_options.get(name)) == value for name, value in parameters.items())
+            if same and record.get("status") == "done" and os.path.exists(record["output"]):
+                done.add(record["input"])
+    return done
+
+
+def run(inputs, output_dir, scheme="CC", levels=1, workers=None, resume=False, options=None, log=sys.stderr):
+    """Subdivide all inputs; returns the records of the jobs run now (the failed ones have status "error")."""
+    os.makedirs(output_dir, exist_ok=True)
+    journal = os.path.join(output_dir, journal_name)
+    scheme = mesh.choose_subdivision_code(scheme)
+    options = options or {}
+    skipped = finished(journal, parameters(scheme, levels, options)) if resume else set()
+    jobs = [(name, output) for name, output in zip(inputs, output_names(inputs, output_dir)) if name not in skipped]
+    if skipped: print(f"resuming: {len(inputs) - len(jobs)} of {len(inputs)} files already done", file=log)
+
+    records = []
+    with open(journal, "a") as f, concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(process, name, output, levels, scheme, options): name for name, output in jobs}
+        try:
+            for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # the worker process died (e.g. out of memory)
+                    record = {"input": futures[future], **parameters(scheme, levels, options), "status": "error", "error": type(e).__name__, "message": str(e)}
+                records.append(record)
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                message = f'{record["seconds"]} s' if record["status"] == "done" else f'{record["error"]}: {record["message"]}'
+                print(f'[{i + 1}/{len(jobs)}] {record["status"]} {record["input"]} ({message})', file=log)
+        except KeyboardInterrupt:
+            executor.shutdown(cancel_futures=True)
+            raise
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Subdivide many meshes in parallel.")
+    parser.add_argument("inputs", nargs="+", help="input files or globs (quoted, ** for subdirectories)")
+    parser.add_argument("--scheme", default="CC", help="CC, DS, LOOP, PR (or CathmulClark, DooSabin, Loop, PetersReif)")
+    parser.add_argument("--levels", type=int, default=1)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--resume", action="store_true", help="skip files done by an earlier run into the same directory")
+    parser.add_argument("--cache", action="store_true", help="reuse levels from the on-disk cache (see cache.py)")
+    parser.add_argument("--repair", action="store_true", help="fix the topology of the inputs first (see validate.py)")
+    parser.add_argument("--threshold", type=float, default=None, help="adaptive subdivision: dihedral angle in degrees")
+    parser.add_argument("--float32", action="store_true", help="float32 positions (previews: half the memory)")
+    parser.add_argument("--decimals", type=int, default=None, help="fixed decimals of the written coordinates")
+    args = parser.parse_args(argv)
+
+    inputs = expand(args.inputs)
+    if not inputs:
+        print("no input files", file=sys.stderr)
+        return 1
+    options = {"threshold": args.threshold, "repair": args.repair, "decimals": args.decimals}
+    if args.float32: options["dtype"] = "float32"
+    if args.cache:
+        from cache import Cache
+        options["cache"] = Cache()
+
+    records = run(inputs, args.output_dir, args.scheme, args.levels, args.workers, args.resume, options)
+    failed = [record for record in records if record["status"] != "done"]
+    print(f"{len(records) - len(failed)} done, {len(failed)} failed (journal: {os.path.join(args.output_dir, journal_name)})", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""Benchmarks of the subdivision schemes.
+
+Every scheme is run level by level on every mesh (cube.off, suzanne.off and
+best_meshes/*.off by default). Each level reports its time (best of a few runs),
+peak RSS and the bytes allocated per new face, and the results are written as
+JSON. A saved result can be used as a baseline: --compare reports every level
+that got slower or needs more memory and exits with 1 if there is one.
+
+How to use it?
+> python bench.py --output baseline.json
+> python bench.py --compare baseline.json
+> python bench.py suzanne.off --schemes CC LOOP --levels 4 --markdown
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from compact import CompactMesh
+from mesh import Mesh
+
+schemes = ["DS", "CC", "LOOP", "PR"]
+
+
+directory = os.path.dirname(os.path.abspath(__file__))
+
+def default_meshes():
+    corpus = sorted(name for name in glob.glob(os.path.join(directory, "best_meshes", "*.off")) if "_smooth" not in name)
+    return [os.path.join(directory, name) for name in ["cube.off", "suzanne.off"]] + corpus
+
+
+def mesh_name(filename):
+    """Name of the mesh in the results: relative to the repository for the default meshes."""
+    path = os.path.relpath(os.path.abspath(filename), directory)
+    return filename if path.startswith("..") else path
+
+
+def reset_peak_rss():
+    """Start a new peak RSS period (Linux only, elsewhere the peak of the whole run is reported)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f: f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def load(filename, scheme, engine):
+    if engine == "object": return Mesh(filename=filename, triangular=scheme == "LOOP")
+    return CompactMesh.from_file(filename, triangular=scheme == "LOOP")
+
+
+def fresh(mesh):
+    """Copy of mesh without what an earlier subdivision of it cached (half-edges, face centers, inside points),
+    so that every repeat does all the work."""
+    if isinstance(mesh, Mesh): return CompactMesh(*mesh.to_arrays()).to_mesh()
+    return CompactMesh(mesh.positions, mesh.face_indices, mesh.face_offsets, mesh.creases)
+
+
+def counts(mesh):
+    if isinstance(mesh, Mesh): return len(mesh.vertices), len(mesh.faces)
+    return mesh.vertex_count, mesh.face_count
+
+
+def run(filename, scheme, levels, engine="compact", repeat=3, max_faces=1 << 21):
+    """Results of levels subdivisions of the mesh, stopping before a level with more than max_faces faces."""
+    results = []
+    mesh = load(filename, scheme, engine)
+    subdivide = lambda m: getattr(m, "subdivision_" + scheme)()
+    for level in range(1, levels + 1):
+        if counts(mesh)[1] * (4 if scheme != "PR" else 2) > max_faces: break
+
+        times = []
+        reset_peak_rss()
+        for i in range(repeat):
+            copy = fresh(mesh)
+            start = time.perf_counter()
+            result = subdivide(copy)
+            times.append(time.perf_counter() - start)
+            if i < repeat - 1: del result
+        rss = peak_rss_mb()
+
+        copy = fresh(mesh)
+        tracemalloc.start()
+        subdivide(copy)
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        mesh = result
+        vertices, faces = counts(mesh)
+        results.append({"mesh": mesh_name(filename), "scheme": scheme, "engine": engine, "level": level, "vertices": vertices, "faces": faces,
+                        "seconds": min(times), "peak_rss_mb": round(rss, 1), "allocated_bytes_per_face": round(allocated / max(faces, 1), 1)})
+    return results
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "processor": platform.processor(), "system": platform.system(), "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def compare(results, baseline, tolerance):
+    """Levels of results slower or bigger than in baseline by more than tolerance (0.25 = 25%)."""
+    old = {(r["mesh"], r["scheme"], r["engine"], r["level"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = old.get((result["mesh"], result["scheme"], result["engine"], result["level"]))
+        if before is None: continue
+        for key in ["seconds", "peak_rss_mb", "allocated_bytes_per_face"]:
+            # differences below 10 ms / 10 MB are noise
+            noise = {"seconds": 0.01, "peak_rss_mb": 10, "allocated_bytes_per_face": 0}[key]
+            if result[key] > before[key] * (1 + tolerance) + noise:
+                regressions.append((result, key, before[key]))
+    return regressions
+
+
+def format_time(seconds):
+    if seconds < 0.001: return str(round(seconds * 1000, 5)) + " ms"
+    if seconds < 0.1: return str(round(seconds * 1000, 2)) + " ms"
+    return str(round(seconds, 2)) + " s"
+
+
+def markdown(results):
+    """Rows of the README tables: vertices | faces | total time, one column per scheme."""
+    columns = []
+    for scheme in schemes:
+        rows, total = [], 0
+        for result in (r for r in results if r["scheme"] == scheme):
+            total += result["seconds"]
+            rows.append(f'{result["vertices"]} \\| {result["faces"]} \\| {format_time(total)}')
+        if rows: columns.append(rows)
+    height = max((len(column) for column in columns), default=0)
+    return ["| " + " | ".join(column[i] if i < len(column) else " " for column in columns) + " |" for i in range(height)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the subdivision schemes.")
+    parser.add_argument("meshes", nargs="*", help=".off files (default: cube.off, suzanne.off, best_meshes/*.off)")
+    parser.add_argument("--schemes", nargs="+", default=schemes, choices=schemes)
+    parser.add_argument("--levels", type=int, default=5)
+    parser.add_argument("--engine", default="compact", choices=["compact", "object"])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per level, the best time is reported")
+    parser.add_argument("--max-faces", type=int, default=1 << 21, help="skip levels with more faces")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for --compare")
+    parser.add_argument("--markdown", action="store_true", help="also print README table rows")
+    args = parser.parse_args(argv)
+
+    results = []
+    for filename in args.meshes or default_meshes():
+        for scheme in args.schemes:
+            try:
+                results += run(filename, scheme, args.levels, args.engine, args.repeat, args.max_faces)
+            except Exception as e:
+                print(f"{mesh_name(filename)} {scheme}: failed ({e})", file=sys.stderr)
+                continue
+            print(f"{mesh_name(filename)} {scheme}: " + ", ".join(format_time(r["seconds"]) for r in results if r["mesh"] == mesh_name(filename) and r["scheme"] == scheme), file=sys.stderr)
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f: json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.markdown:
+        for filename in sorted(set(r["mesh"] for r in results)):
+            print(f"\n{filename}", file=sys.stderr)
+            for row in markdown([r for r in results if r["mesh"] == filename]): print(row, file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for result, key, before in regressions:
+            print(f'REGRESSION {result["mesh"]} {result["scheme"]} level {result["level"]}: {key} {before} -> {result[key]}', file=sys.stderr)
+        print(f"{len(regressions)} regressions against {args.compare}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
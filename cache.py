@@ -0,0 +1,148 @@
+"""Content-addressed on-disk cache of subdivision results.
+
+Every level of a subdivision is stored as an .npz file named by the hash of the
+input mesh content (positions and faces, not the file name), the scheme, the
+level and the other options changing the result (e.g. the adaptive threshold).
+A request for level 5 resumes from the highest cached level below it and caches
+the levels it computes. Entries are written to a temporary file and renamed
+into place, so processes sharing the cache never read a half-written entry and
+two processes computing the same level just store the same content twice. Every
+hit refreshes the modification time of the entry, and when the cache outgrows
+max_bytes the least recently used entries are removed (an entry removed while
+another process reads it is only a miss there).
+
+How to use it?
+> cache = Cache()                      # ~/.cache/subdivision or $SUBDIVISION_CACHE
+> mesh5 = cache.subdivision(CompactMesh.from_file("bun.off"), "CC", 5)
+or
+> subdivision("bun.off", "bun_smooth.off", 5, "CathmulClark", cache=Cache())
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+import profiling
+from compact import CompactMesh
+
+default_directory = os.environ.get("SUBDIVISION_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "subdivision")
+default_max_bytes = 1 << 30
+stale_seconds = 3600
+
+
+def mesh_hash(mesh):
+    """SHA-256 of the positions (and their dtype), faces and creases of a CompactMesh."""
+    digest = hashlib.sha256()
+    # a float32 mesh and its float64 twin subdivide into different numbers
+    digest.update(mesh.positions.dtype.str.encode())
+    arrays = [(mesh.positions, "<f8"), (mesh.face_indices, "<i8"), (mesh.face_offsets, "<i8")]
+    if mesh.creases is not None: arrays += [(mesh.creases[0], "<i8"), (mesh.creases[1], "<f8")]
+    for array, dtype in arrays:
+        array = np.ascontiguousarray(array, dtype=dtype)
+        digest.update(repr(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class Cache:
+    def __init__(self, directory=None, max_bytes=default_max_bytes):
+        self.directory = directory or default_directory
+        self.max_bytes = max_bytes
+
+    def key(self, content, algorithm, level, **options):
+        """Key of level of the mesh with content hash content subdivided by algorithm."""
+        parameters = ",".join(f"{name}={value!r}" for name, value in sorted(options.items()))
+        return hashlib.sha256(f"{content}:{algorithm}:{level}:{parameters}".encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npz")
+
+    def get(self, key):
+        """Cached CompactMesh or None."""
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                creases = (data["crease_pairs"], data["crease_weights"]) if "crease_pairs" in data else None
+                mesh = CompactMesh(data["positions"], data["face_indices"], data["face_offsets"], creases)
+            os.utime(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        return mesh
+
+    def put(self, key, mesh):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(descriptor)
+        arrays = {"positions": mesh.positions, "face_indices": mesh.face_indices, "face_offsets": mesh.face_offsets}
+        if mesh.creases is not None: arrays.update(crease_pairs=mesh.creases[0], crease_weights=mesh.creases[1])
+        try:
+            with open(temporary, "wb") as f: np.savez(f, **arrays)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.evict()
+
+    def entries(self):
+        """(modification time, size, path) of every entry."""
+        result = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".npz"): result.append((stat.st_mtime, stat.st_size, path))
+                # left by a writer that crashed
+                elif name.endswith(".tmp") and stat.st_mtime < time.time() - stale_seconds: self.remove(path)
+        return result
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes: break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries(): self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def subdivision(self, mesh, algorithm, iterations_count, step=None, progress=None, **options):
+        """iterations_count levels of mesh, resuming from the highest cached level;
+        step(mesh) computes one level (mesh.subdivide(algorithm) by default) and
+        progress(level, iterations_count) is called after the cached and every computed level."""
+        step = step or (lambda m: m.subdivide(algorithm))
+        content = mesh_hash(mesh)
+        level = 0
+        with profiling.phase("cache.get") as phase:
+            for k in range(iterations_count, 0, -1):
+                cached = self.get(self.key(content, algorithm, k, **options))
+                if cached is not None:
+                    level, mesh = k, cached
+                    break
+            phase.count(level=level)
+        if progress and level: progress(level, iterations_count)
+
+        for k in range(level + 1, iterations_count + 1):
+            mesh = step(mesh)
+            with profiling.phase("cache.put"):
+                self.put(self.key(content, algorithm, k, **options), mesh)
+            if progress: progress(k, iterations_count)
+        return mesh
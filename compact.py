@@ -0,0 +1,422 @@
+"""Compact, array-backed counterpart of mesh.Mesh.
+
+Vertices are stored as one (N, 3) NumPy position array and faces as a flat
+integer index array plus offsets (face i is face_indices[face_offsets[i]:face_offsets[i+1]]),
+so big meshes don't need a Python object per vertex/face. Adjacency is kept in a
+half-edge table (CompactMesh.halfedges) which is built once and cached.
+Edges can carry (semi-)sharp crease weights for Catmull-Clark: creases is a
+pair of arrays (vertex pairs, sharpness), loaded from the .creases file next to
+the mesh by from_file.
+
+How to use it?
+> mesh = CompactMesh.from_file("cube.off")
+> mesh2 = mesh.subdivision_CC()
+> mesh2.save("cube_smooth.off")
+> preview = CompactMesh.from_file("scan.off", dtype=np.float32)   # half the memory, see off.py
+> preview.subdivision_CC().save("scan_preview.off", decimals=4)
+> obj = mesh2.to_mesh()                  # back to the Vertex/Face object model
+> compact = CompactMesh.from_mesh(obj)
+> creased = CompactMesh(mesh.positions, mesh.face_indices, mesh.face_offsets, creases=([[0, 1]], [2.5]))
+"""
+
+import math
+
+import numpy as np
+import scipy.sparse as sparse
+
+import mesh as object_model
+import off
+import profiling
+# kinds of elements of a level that new vertices come from
+from mesh import VERTEX, EDGE, FACE, CORNER
+
+
+def scatter_add(index, values, size):
+    """result[index[i]] += values[i] for an (n, 3) values array (vectorized np.add.at)."""
+    return np.stack([np.bincount(index, weights=values[:, j], minlength=size) for j in range(values.shape[1])], axis=1)
+
+
+def gather_faces(indices, offsets, order):
+    """Face arrays (indices, offsets) holding the faces listed in order."""
+    sizes = np.diff(offsets)[order]
+    new_offsets = np.concatenate([[0], np.cumsum(sizes)])
+    shift = np.repeat(offsets[:-1][order] - new_offsets[:-1], sizes)
+    return indices[np.arange(new_offsets[-1]) + shift], new_offsets
+
+
+_loop_alphas = np.ones(1)
+
+def loop_alphas(valence):
+    """Loop's vertex weight 3/8 + (3/8 + cos(2pi/n)/4)^2 per valence, from a lookup table shared by all calls."""
+    global _loop_alphas
+    if len(valence) and valence.max() >= len(_loop_alphas):
+        n = np.arange(1, max(int(valence.max()) + 1, 2 * len(_loop_alphas)))
+        _loop_alphas = np.concatenate([[1.0], 3/8 + (3/8 + np.cos(2 * math.pi / n) / 4)**2])
+    return _loop_alphas[valence]
+
+
+class HalfEdges:
+    """Half-edge / twin table of a polygon mesh.
+
+    Half-edge i starts at face corner i (origin = face_indices[i]) and goes to the
+    next corner of the same face. Twins are matched by undirected edge, so meshes
+    with inconsistent face orientation (cube.off) are handled as well. Undirected
+    edges are numbered in order of first appearance, like the edge_points dicts
+    of Mesh.subdivision_*.
+    """
+
+    def __init__(self, face_indices, face_offsets, vertex_count, edges=None):
+        """edges: (edge, edge_halfedge, twin) if known already (see peters_reif.py), otherwise matched here."""
+        count = len(face_indices)
+        sizes = np.diff(face_offsets)
+        index = np.arange(count)
+
+        self.origin = face_indices
+        self.face = np.repeat(np.arange(len(sizes)), sizes)
+        start = face_offsets[:-1][self.face]
+        end = face_offsets[1:][self.face]
+        self.next = np.where(index + 1 == end, start, index + 1)
+        self.prev = np.where(index == start, end - 1, index - 1)
+        self.dest = self.origin[self.next]
+
+        if edges is not None:
+            self.edge, self.edge_halfedge, self.twin = edges
+            self.edge_vertices = np.stack([self.origin[self.edge_halfedge], self.dest[self.edge_halfedge]], axis=1)
+            self.edge_faces_count = np.bincount(self.edge, minlength=len(self.edge_halfedge))
+        else:
+            self.match_edges(vertex_count)
+
+        self.vertex_count = vertex_count
+        self._rings = None
+        self._adjacency = None
+
+    def match_edges(self, vertex_count):
+        """Number the undirected edges and find the twins by sorting the edge keys."""
+        index = np.arange(len(self.origin))
+        keys = np.minimum(self.origin, self.dest) * vertex_count + np.maximum(self.origin, self.dest)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        self.edge = rank[inverse].reshape(-1)
+        self.edge_halfedge = first[order]
+        self.edge_vertices = np.stack([self.origin[self.edge_halfedge], self.dest[self.edge_halfedge]], axis=1)
+        self.edge_faces_count = np.bincount(self.edge, minlength=len(order))
+
+        # twin of the first half-edge of an edge is the second one, every other
+        # half-edge (there are more only for non-manifold edges) points to the first
+        grouped = np.argsort(self.edge, kind="stable")
+        group_start = np.concatenate([[0], np.cumsum(self.edge_faces_count)[:-1]])
+        second = np.full(len(order), -1)
+        shared = self.edge_faces_count > 1
+        second[shared] = grouped[group_start[shared] + 1]
+        primary = self.edge_halfedge[self.edge]
+        self.twin = np.where(index == primary, second[self.edge], primary)
+
+    def __len__(self): return len(self.origin)
+
+    @property
+    def edge_count(self): return len(self.edge_halfedge)
+
+    @property
+    def boundary_edges(self): return self.edge_faces_count == 1
+
+    def adjacency(self):
+        """Vertex-to-vertex adjacency as a CSR matrix (one entry per neighbour)."""
+        if self._adjacency is None:
+            a, b = self.edge_vertices.T
+            rows, cols = np.concatenate([a, b]), np.concatenate([b, a])
+            self._adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(self.vertex_count, self.vertex_count))
+        return self._adjacency
+
+    def vertex_rings(self):
+        """Faces around every vertex, in order (one-ring walk).
+
+        Returns (offsets, corners, flips, closed): corners[offsets[v]:offsets[v+1]] are
+        the half-edges starting at v, one per incident face, in rotation order. A ring
+        leaves corner c through its incoming half-edge prev(c) when flips is True and
+        through c otherwise. Open rings (boundary vertices) start at the face with a
+        boundary edge and closed[v] tells whether the walk came back to its start.
+        """
+        if self._rings is not None: return self._rings
+
+        boundary = self.boundary_edges
+        priority = np.where(boundary[self.edge], 0, np.where(boundary[self.edge[self.prev]], 1, 2))
+        valence = np.bincount(self.origin, minlength=self.vertex_count)
+        # start at the corner with the lowest (priority, index) of every vertex, without sorting
+        count = len(self.origin)
+        lowest = np.full(self.vertex_count, 3 * count)
+        np.minimum.at(lowest, self.origin, priority * count + np.arange(count))
+
+        vertices = np.flatnonzero(valence)
+        start = lowest[vertices] % max(count, 1)
+        corner = start
+        flip = priority[start] != 1
+        closed = np.zeros(self.vertex_count, dtype=bool)
+
+        steps_vertices, steps_corners, steps_flips = [], [], []
+        for step in range(int(valence.max(initial=0))):
+            steps_vertices.append(vertices)
+            steps_corners.append(corner)
+            steps_flips.append(flip)
+
+            exit = np.where(flip, self.prev[corner], corner)
+            twin = self.twin[exit]
+            forward = self.origin[twin] == vertices
+            corner = np.where(forward, twin, self.next[twin])
+            flip = forward
+
+            back = (twin >= 0) & (corner == start)
+            closed[vertices[back]] = True
+            active = (twin >= 0) & ~back & (step + 1 < valence[vertices])
+            vertices, corner, flip, start = vertices[active], corner[active], flip[active], start[active]
+            if len(vertices) == 0: break
+
+        # step i of vertex v goes to offsets[v] + i
+        counts = np.zeros(self.vertex_count, dtype=np.int64)
+        for step_vertices in steps_vertices: counts[step_vertices] += 1
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        corners = np.zeros(offsets[-1], dtype=np.int64)
+        flips = np.zeros(offsets[-1], dtype=bool)
+        for step, (step_vertices, step_corners, step_flips) in enumerate(zip(steps_vertices, steps_corners, steps_flips)):
+            corners[offsets[step_vertices] + step] = step_corners
+            flips[offsets[step_vertices] + step] = step_flips
+
+        self._rings = offsets, corners, flips, closed
+        return self._rings
+
+
+class Stencil:
+    """Topology of the next level of a scheme (CompactMesh.stencil_*).
+
+    The new positions are matrix @ positions, so the same stencil works for any vertex
+    positions. New vertices come in blocks of (kind, count): one vertex per old
+    vertex/edge/face/corner, in the order of the old elements. Every new face comes from
+    an old element too: face_major is the old face it lies in (or face_count + v for the
+    faces around old vertex v) and face_minor the old corner it belongs to (-1 if none);
+    the faces are sorted by (face_major, face_minor). creases are the crease weights of
+    the next level (like CompactMesh.creases).
+    """
+
+    def __init__(self, matrix, face_indices, face_offsets, blocks, face_major, face_minor, creases=None):
+        self.matrix = matrix
+        self.face_indices = face_indices
+        self.face_offsets = face_offsets
+        self.blocks = blocks
+        self.face_major = face_major
+        self.face_minor = face_minor
+        self.creases = creases
+
+    def block_offset(self, kind):
+        offset = 0
+        for block_kind, count in self.blocks:
+            if block_kind == kind: return offset
+            offset += count
+        raise Exception(f"stencil has no vertices of kind {kind}")
+
+
+class CompactMesh:
+    def __init__(self, positions, face_indices, face_offsets, creases=None):
+        positions = np.asarray(positions)
+        # float32 positions (from_file(..., dtype=np.float32)) stay float32 through the levels
+        self.positions = positions.astype(np.float32 if positions.dtype == np.float32 else float, copy=False).reshape(-1, 3)
+        self.face_indices = np.asarray(face_indices, dtype=np.int64)
+        self.face_offsets = np.asarray(face_offsets, dtype=np.int64)
+        if creases is not None:
+            pairs, weights = creases
+            creases = np.asarray(pairs, dtype=np.int64).reshape(-1, 2), np.asarray(weights, dtype=float).reshape(-1)
+        self.creases = creases
+        self._halfedges = None
+        self._centers = None
+
+    @classmethod
+    def from_faces(cls, positions, faces):
+        sizes = [len(face) for face in faces]
+        offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+        indices = np.fromiter((v for face in faces for v in face), dtype=np.int64, count=int(offsets[-1]))
+        return cls(positions, indices, offsets)
+
+    @classmethod
+    def from_mesh(cls, mesh):
+        return cls(*mesh.to_arrays())
+
+    @classmethod
+    def from_file(cls, filename, triangular=False, dtype=float):
+        return cls(*off.read_mesh(filename, triangular, dtype), creases=off.read_creases(filename)).cleanup()
+
+    def to_mesh(self):
+        vertices = [object_model.Vertex(x, y, z, id=i) for i, (x, y, z) in enumerate(self.positions.tolist())]
+        faces = [object_model.Face([vertices[i] for i in face]) for face in self.faces()]
+        return object_model.Mesh(vertices=vertices, faces=faces)
+
+    def __str__(self):
+        return f"vertices: {self.vertex_count}\nfaces: {self.face_count}"
+
+    @property
+    def vertex_count(self): return len(self.positions)
+
+    @property
+    def face_count(self): return len(self.face_offsets) - 1
+
+    @property
+    def face_sizes(self): return np.diff(self.face_offsets)
+
+    @property
+    def halfedges(self):
+        if self._halfedges is None:
+            with profiling.phase("halfedges") as phase:
+                self._halfedges = HalfEdges(self.face_indices, self.face_offsets, self.vertex_count)
+                phase.count(halfedges=len(self._halfedges))
+        return self._halfedges
+
+    def cleanup(self):
+        """Mesh without faces with less than 3 different vertices and without unused vertices (like Mesh.__init__)."""
+        face = np.repeat(np.arange(self.face_count), self.face_sizes)
+        keys = np.sort(face * self.vertex_count + self.face_indices)
+        distinct = keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if len(keys) else keys
+        valid = np.bincount(distinct // self.vertex_count, minlength=self.face_count) >= 3
+        indices, offsets = gather_faces(self.face_indices, self.face_offsets, np.flatnonzero(valid))
+
+        used = np.bincount(indices, minlength=self.vertex_count) > 0
+        if valid.all() and used.all(): return self
+        mapping = np.cumsum(used) - 1
+        creases = None
+        if self.creases is not None:
+            pairs, weights = self.creases
+            kept = used[pairs].all(axis=1)
+            creases = mapping[pairs[kept]], weights[kept]
+        return CompactMesh(self.positions[used], mapping[indices], offsets, creases)
+
+    def submesh(self, faces):
+        """(CompactMesh of the listed faces, numbers of its vertices in this mesh)."""
+        indices, offsets = gather_faces(self.face_indices, self.face_offsets, faces)
+        vertices, local = np.unique(indices, return_inverse=True)
+        return CompactMesh(self.positions[vertices], local.reshape(-1), offsets), vertices
+
+    def neighbourhood(self, faces):
+        """Sorted numbers of the listed faces and of all faces sharing a vertex with them."""
+        touched = np.zeros(self.vertex_count, dtype=bool)
+        touched[gather_faces(self.face_indices, self.face_offsets, faces)[0]] = True
+        return np.unique(self.halfedges.face[touched[self.face_indices]])
+
+    def faces(self):
+        indices = self.face_indices.tolist()
+        offsets = self.face_offsets.tolist()
+        return [indices[a:b] for a, b in zip(offsets, offsets[1:])]
+
+    def face_centers(self):
+        sums = np.add.reduceat(self.positions[self.face_indices], self.face_offsets[:-1], axis=0)
+        return sums / self.face_sizes[:, None]
+
+    def save(self, filename, binary=False, decimals=None):
+        off.write_mesh(filename, self.positions, self.face_indices, self.face_offsets, binary, decimals)
+        # (no file once the creases have decayed after enough levels)
+        if self.creases is not None and np.any(self.creases[1] > 0): off.write_creases(filename, *self.creases)
+
+    def edge_sharpness(self):
+        """Crease weight of every edge (halfedges numbering), 0 for smooth edges."""
+        he = self.halfedges
+        sharpness = np.zeros(he.edge_count)
+        if self.creases is None or len(self.creases[1]) == 0: return sharpness
+        pairs, weights = self.creases
+        n = self.vertex_count
+        edge_keys = he.edge_vertices.min(axis=1) * n + he.edge_vertices.max(axis=1)
+        order = np.argsort(edge_keys)
+        keys = pairs.min(axis=1) * n + pairs.max(axis=1)
+        found = np.minimum(np.searchsorted(edge_keys, keys, sorter=order), len(order) - 1)
+        edges = order[found]
+        missing = edge_keys[edges] != keys
+        if np.any(missing): raise Exception(f"crease {pairs[missing][0].tolist()} is not an edge of the mesh")
+        np.maximum.at(sharpness, edges, weights)
+        return sharpness
+
+    def centers_stencil(self):
+        """(faces x vertices) matrix of face centers (built once, like halfedges)."""
+        if self._centers is None:
+            he = self.halfedges
+            self._centers = sparse.csr_matrix((1 / self.face_sizes[he.face], (he.face, he.origin)), shape=(self.face_count, self.vertex_count))
+        return self._centers
+
+    # stencil_* methods return the topology of the next level as a Stencil,
+    # built from the declarative schemes of rules.py
+
+    def stencil(self, scheme):
+        """Stencil of the scheme (a Scheme or the name of a registered one, see rules.py)."""
+        import rules
+        return (rules.schemes[scheme] if isinstance(scheme, str) else scheme).stencil(self)
+
+    def stencil_DS(self): return self.stencil("DS")
+
+    def stencil_CC(self): return self.stencil("CC")
+
+    def stencil_LOOP(self): return self.stencil("LOOP")
+
+    def stencil_PR(self): return self.stencil("PR")
+
+    def crease_rules(self, vertex_stencil, edge_stencil):
+        """Catmull-Clark vertex and edge stencils with the crease weights applied, and the creases of the next level.
+
+        Edges with sharpness >= 1 get their midpoint. A vertex with two sharp edges a, b
+        gets 3/4 v + (a + b)/8, one with more sharp edges stays in place. Fractional
+        sharpness (of the edge, or the average of the sharp edges of a vertex) blends
+        the smooth and the sharp point, and both halves of an edge get its sharpness - 1.
+        """
+        he = self.halfedges
+        n, e = self.vertex_count, he.edge_count
+        sharpness = self.edge_sharpness()
+        sharp = np.flatnonzero(sharpness > 0)
+        a, b = he.edge_vertices[sharp].T
+
+        t = np.minimum(sharpness, 1)
+        midpoints = sparse.csr_matrix((np.full(2 * len(sharp), 1/2), (np.repeat(sharp, 2), he.edge_vertices[sharp].ravel())), shape=(e, n))
+        edge_stencil = sparse.diags(1 - t) @ edge_stencil + sparse.diags(t) @ midpoints
+
+        ends = np.concatenate([a, b])
+        count = np.bincount(ends, minlength=n)
+        vertex_sharpness = np.bincount(ends, weights=np.tile(sharpness[sharp], 2), minlength=n) / np.maximum(count, 1)
+        w = np.where(count >= 2, np.minimum(vertex_sharpness, 1), 0)
+        crease = count[ends] == 2
+        rule = (sparse.diags(np.where(count == 2, 3/4, (count > 2).astype(float)))
+                + sparse.csr_matrix((np.full(np.count_nonzero(crease), 1/8), (ends[crease], np.concatenate([b, a])[crease])), shape=(n, n)))
+        vertex_stencil = sparse.diags(1 - w) @ vertex_stencil + sparse.diags(w) @ rule
+
+        left = sharpness[sharp] > 1
+        pairs = np.concatenate([np.stack([a, n + sharp], axis=1)[left], np.stack([n + sharp, b], axis=1)[left]])
+        return vertex_stencil, edge_stencil, (pairs, np.tile(sharpness[sharp][left] - 1, 2))
+
+    def refine(self, stencil):
+        with profiling.phase("refine") as phase:
+            phase.count(vertices=stencil.matrix.shape[0], faces=len(stencil.face_offsets) - 1)
+            # float32 meshes stay float32 (parallel, adaptive and hierarchy cast the matrix the same way)
+            matrix = stencil.matrix if self.positions.dtype == float else stencil.matrix.astype(self.positions.dtype)
+            return CompactMesh(matrix @ self.positions, stencil.face_indices, stencil.face_offsets, stencil.creases)
+
+    def subdivide(self, algorithm):
+        """One serial level of the scheme (CC, DS, LOOP, PR, SQRT3 or any registered in rules.py): its stencil applied by refine()."""
+        with profiling.phase(str(getattr(algorithm, "name", algorithm)) + ".stencil") as phase:
+            stencil = self.stencil(algorithm)
+            phase.count(nonzeros=stencil.matrix.nnz)
+        return self.refine(stencil)
+
+    def subdivision_parallel(self, algorithm, workers=None):
+        """One level in worker processes (all cores for workers=None), see parallel.py."""
+        import parallel
+        return parallel.subdivision(self, algorithm, 1, workers)
+
+    def subdivision_adaptive(self, algorithm="CC", threshold=10, error=None):
+        """One level refining only the faces with error above threshold (dihedral angle in degrees by default), see adaptive.py."""
+        import adaptive
+        return adaptive.subdivision(self, algorithm, threshold, error)
+
+    def subdivision_DS(self, workers=1): return self.subdivide("DS") if workers == 1 else self.subdivision_parallel("DS", workers)
+
+    def subdivision_CC(self, workers=1): return self.subdivide("CC") if workers == 1 else self.subdivision_parallel("CC", workers)
+
+    def subdivision_LOOP(self, workers=1): return self.subdivide("LOOP") if workers == 1 else self.subdivision_parallel("LOOP", workers)
+
+    def subdivision_PR(self, workers=1):
+        """Same result as subdivide("PR"), by peters_reif.subdivide (keeps the half-edges for the next level)."""
+        if workers != 1: return self.subdivision_parallel("PR", workers)
+        import peters_reif
+        return peters_reif.subdivide(self)
@@ -4,15 +4,21 @@ from tkinter.font import Font
 from tkinter import messagebox
 from tkinter import ttk
 import utils 
-import mesh
+from cache import Cache
+from jobs import JobQueue
+
+poll_milliseconds = 100
 
 class State:
     def __init__(self):
-        self.app = utils.app
+        self.app = utils.create_app()
         self.app.configure(bg=utils.dark_blue)
         self.filename_input = None
         self.filename_output = None
         self.selected_algorithm = "CathmulClark"
+        self.cache = Cache()
+        self.jobs = JobQueue()
+        self.poll_id = None
         self.info_frame = Frame(self.app, background=utils.dark_blue)
 
         self.app.title('Subdivision')
@@ -37,6 +43,14 @@ class State:
 
         run_button.pack(pady = 10)
 
+        self.progress_bar = ttk.Progressbar(self.app, orient=HORIZONTAL, mode="determinate")
+        self.progress_bar.pack(fill=X, padx=20)
+        self.status = Label(self.app, text="", bg=utils.dark_blue, fg=utils.white)
+        self.status.pack()
+        self.jobs_list = Listbox(self.app, height=4)
+        self.jobs_list.pack(fill=X, padx=20, pady=5)
+        Button(self.app, text="Cancel selected job", command=self.cancel_job).pack(pady=5)
+
     def actualize_font(self):
         utils.font_size = utils.set_height(1 / 25)
         utils.normal_font = Font(family="Open Sans", size=utils.font_size)
@@ -50,27 +64,66 @@ class State:
         self.filename_output = utils.validate_filename(self.text_box.get())
         if not self.filename_input: messagebox.showinfo("Input file!", "Please specify your input file!") 
         if not iterations_count or not self.filename_output: return None
-        mesh.subdivision(self.filename_input, self.filename_output, iterations_count, self.algorithm_menu.get())
-        messagebox.showinfo("Success!", "Your mesh has been saved!")
+        self.jobs.submit(self.filename_input, self.filename_output, iterations_count, self.algorithm_menu.get(), cache=self.cache)
+        self.show_jobs()
+        self.poll_jobs()
+
+    def cancel_job(self):
+        selection = self.jobs_list.curselection()
+        jobs = self.jobs.jobs()
+        if not selection or selection[0] >= len(jobs): return
+        job = jobs[selection[0]]
+        self.jobs.cancel(job.id)
+        self.status.configure(text=f"Cancelled {job.filename_output}")
+        self.progress_bar.configure(value=0)
+        self.show_jobs()
+        self.poll_jobs()
+
+    def show_jobs(self):
+        self.jobs_list.delete(0, END)
+        for job in self.jobs.jobs():
+            state = "running" if job is self.jobs.running else "waiting"
+            self.jobs_list.insert(END, f"{state}: {job.filename_output} ({job.algorithm_name}, {job.iterations_count} iterations)")
+
+    def poll_jobs(self):
+        """Handles the events of the jobs; polls again only while there are jobs, so an idle window uses no CPU."""
+        if self.poll_id is not None: self.app.after_cancel(self.poll_id)
+        self.poll_id = None
+        for event in self.jobs.poll():
+            if event[0] == "start":
+                self.progress_bar.configure(value=0, maximum=self.jobs.running.iterations_count)
+                self.status.configure(text=f"Subdividing {self.jobs.running.filename_input}...")
+            elif event[0] == "progress":
+                self.progress_bar.configure(value=event[2])
+                self.status.configure(text=f"Level {event[2]} of {event[3]}")
+            elif event[0] == "done":
+                self.status.configure(text=f"Your mesh has been saved to {event[2]}!")
+            elif event[0] == "error":
+                messagebox.showinfo("Error!", f"Subdivision failed: {event[2]}")
+            self.show_jobs()
+        if self.jobs.active():
+            self.poll_id = self.app.after(poll_milliseconds, self.poll_jobs)
+
+    def resize(self, event):
+        if event.widget is not self.app: return
+        if utils.window_width == self.app.winfo_width() and utils.window_height == self.app.winfo_height(): return
+        if self.app.winfo_width() * 2 / 3 > self.app.winfo_height():
+            utils.window_width = int(self.app.winfo_height() * 3 / 2)
+            utils.window_height = self.app.winfo_height()
+        else:
+            utils.window_width = self.app.winfo_width()
+            utils.window_height = int(self.app.winfo_width() * 2 / 3)
+
+        self.app.geometry(str(utils.window_width) + "x" + str(utils.window_height))
+        self.actualize_font()
+        #state.place()
 
-    
 
 def main():
     state = State()
-    # App responsiveness:
-    while True:
-        state.app.update()
-        if utils.window_width != state.app.winfo_width() or utils.window_height != state.app.winfo_height():
-            if state.app.winfo_width() * 2 / 3 > state.app.winfo_height():
-                utils.window_width = int(state.app.winfo_height() * 3 / 2)
-                utils.window_height = state.app.winfo_height()
-            else:
-                utils.window_width = state.app.winfo_width()
-                utils.window_height = int(state.app.winfo_width() * 2 / 3)
-
-            state.app.geometry(str(utils.window_width) + "x" + str(utils.window_height))
-            state.actualize_font()
-            #state.place()
+    # App responsiveness: resizing is handled when the window changes, not in a loop
+    state.app.bind("<Configure>", state.resize)
+    state.app.mainloop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,64 @@
+"""Subdivision hierarchy for interactive editing of the control mesh.
+
+Every level of the subdivision is kept together with the stencil matrix that
+computed it from the level before (row: new vertex, columns: the control
+vertices it depends on) and its transpose (the new vertices that depend on every
+control vertex). After move_vertices only the new vertices depending on the moved
+ones are recomputed, level by level, from their stencil rows, so a local edit
+costs as much as the region it changes, not the whole mesh. The positions are
+exactly those of subdividing the edited mesh from scratch.
+
+How to use it?
+> hierarchy = Hierarchy(CompactMesh.from_file("best_meshes/bun.off"), "LOOP", 4)
+> hierarchy.move_vertices([10, 11], [[0, 0, 1], [0, 0.1, 1]])
+> hierarchy.mesh.save("bun_edited.off")
+"""
+
+import numpy as np
+
+import profiling
+from compact import CompactMesh, gather_faces
+
+
+class Hierarchy:
+    """levels subdivisions of mesh by the scheme (CC, DS, LOOP, PR or any in rules.py); meshes[0] is the control mesh."""
+
+    def __init__(self, mesh, algorithm="CC", levels=1):
+        self.algorithm = algorithm
+        self.meshes = [CompactMesh(mesh.positions.copy(), mesh.face_indices, mesh.face_offsets, mesh.creases)]
+        self.matrices = []
+        self.dependants = []
+        for i in range(levels):
+            stencil = self.meshes[-1].stencil(algorithm)
+            self.matrices.append(stencil.matrix.tocsr().astype(self.meshes[0].positions.dtype))
+            self.dependants.append(stencil.matrix.T.tocsr())
+            self.meshes.append(self.meshes[-1].refine(stencil))
+
+    @classmethod
+    def from_file(cls, filename, algorithm="CC", levels=1):
+        return cls(CompactMesh.from_file(filename, triangular=algorithm == "LOOP"), algorithm, levels)
+
+    @property
+    def mesh(self):
+        """The finest level."""
+        return self.meshes[-1]
+
+    @property
+    def levels(self): return len(self.matrices)
+
+    def move_vertices(self, ids, new_positions):
+        """Move the control vertices ids to new_positions and update every level.
+        Returns the changed vertices of every level (ids first)."""
+        changed, order = np.unique(np.asarray(ids, dtype=np.int64).reshape(-1), return_inverse=True)
+        positions = np.empty((len(changed), 3))
+        positions[order] = np.asarray(new_positions, dtype=float).reshape(-1, 3)
+
+        with profiling.phase("move_vertices") as phase:
+            self.meshes[0].positions[changed] = positions
+            result = [changed]
+            for matrix, dependants, parent, child in zip(self.matrices, self.dependants, self.meshes, self.meshes[1:]):
+                changed = np.unique(gather_faces(dependants.indices, dependants.indptr, changed)[0])
+                child.positions[changed] = matrix[changed] @ parent.positions
+                result.append(changed)
+            phase.count(vertices=sum(len(level) for level in result))
+        return result
@@ -0,0 +1,119 @@
+"""Queue of subdivision jobs run one by one in a worker process.
+
+Every job is one mesh.subdivision call run in its own process, so the caller
+(the GUI) never waits for it: poll() returns what happened since the last call
+(a job started, finished a level, was saved or failed) and starts the next
+pending job when the previous one is over. Cancelling a pending job drops it,
+cancelling the running one terminates its process (levels already cached stay
+in the cache, the output file is only written after the last level).
+
+How to use it?
+> jobs = JobQueue()
+> job = jobs.submit("bun.off", "bun_smooth.off", 4, "CathmulClark")
+> while jobs.active():
+>     for event in jobs.poll(): print(event)
+>     time.sleep(0.1)
+"""
+
+import collections
+import multiprocessing
+import queue
+
+import mesh
+
+# spawn everywhere: forking a process that has started Tk isn't safe (macOS); the worker runs
+# mesh.subdivision and the GUI modules it imports again as the main module open no window
+context = multiprocessing.get_context("spawn")
+
+Job = collections.namedtuple("Job", ["id", "filename_input", "filename_output", "iterations_count", "algorithm_name", "options"])
+
+
+def work(job, events):
+    try:
+        mesh.subdivision(job.filename_input, job.filename_output, job.iterations_count, job.algorithm_name,
+                         progress=lambda level, count: events.put(("progress", job.id, level, count)), **job.options)
+        events.put(("done", job.id, job.filename_output))
+    except Exception as e:
+        events.put(("error", job.id, f"{type(e).__name__}: {e}"))
+
+
+class JobQueue:
+    def __init__(self):
+        self.pending = collections.deque()
+        self.running = None
+        self.process = None
+        self.events = None
+        self.counter = 0
+
+    def submit(self, filename_input, filename_output, iterations_count, algorithm_name, **options):
+        """Queue a mesh.subdivision call (options: its keyword arguments, e.g. cache); returns the job."""
+        self.counter += 1
+        job = Job(self.counter, filename_input, filename_output, iterations_count, algorithm_name, options)
+        self.pending.append(job)
+        return job
+
+    def jobs(self):
+        """The running job (if any) and the pending ones."""
+        return ([self.running] if self.running else []) + list(self.pending)
+
+    def active(self):
+        return self.running is not None or len(self.pending) > 0
+
+    def cancel(self, job_id):
+        """Drop the pending job or stop the running one; returns False for unknown jobs."""
+        for job in self.pending:
+            if job.id == job_id:
+                self.pending.remove(job)
+                return True
+        if self.running is None or self.running.id != job_id: return False
+        self.process.terminate()
+        self.process.join()
+        self.finish()
+        return True
+
+    def finish(self):
+        self.running = None
+        self.process = None
+        # every job has its own queue, one broken by terminate() is dropped with it
+        self.events = None
+
+    def drain(self):
+        """Events left in the queue of the finished worker."""
+        result = []
+        while True:
+            try:
+                # (a worker flushes its queue before it exits)
+                result.append(self.events.get_nowait())
+            except queue.Empty:
+                return result
+
+    def poll(self):
+        """Events since the last poll: ("start", id), ("progress", id, level, count), ("done", id, filename_output)
+        or ("error", id, message); starts the next job when nothing runs."""
+        result = []
+        while self.running is not None:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                if self.process.is_alive(): break
+                self.process.join()
+                # the worker may have put its last events between get_nowait() and is_alive()
+                last = self.drain()
+                result += last
+                if self.process.exitcode != 0 and not any(event[0] in ("done", "error") for event in last):
+                    # the worker died without a word (killed, out of memory)
+                    result.append(("error", self.running.id, f"worker exited with code {self.process.exitcode}"))
+                self.finish()
+                break
+            result.append(event)
+            if event[0] in ("done", "error"):
+                self.process.join()
+                self.finish()
+
+        if self.running is None and self.pending:
+            self.running = self.pending.popleft()
+            self.events = context.Queue()
+            self.process = context.Process(target=work, args=(self.running, self.events), daemon=True)
+            self.process.start()
+            result.append(("start", self.running.id))
+        return result
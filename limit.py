@@ -0,0 +1,359 @@
+"""Limit surface of Catmull-Clark and Loop subdivision, without refining the whole mesh.
+
+Vertices: around every vertex the scheme maps its ring (the vertex, its
+neighbours and, for quads, the opposite corners of its faces) onto the ring of
+the next level by a small matrix. Its dominant left eigenvector is the limit mask
+of the vertex and the next two give the tangents. Rings of the same size and
+type share the matrix, so it is taken from the scheme's own stencil once per type.
+
+Points: evaluate() takes (face, u, v) parameters of a quad mesh (CC) or a
+triangle mesh (LOOP, barycentric u, v). Regular faces are evaluated exactly:
+Catmull-Clark quads are bicubic B-splines and Loop triangles quartic box splines
+(fitted once to the limit of the scheme on a flat lattice). Other faces are refined locally
+(only the face and the faces around it), going to the child that holds the
+point, until the child is regular or depth levels are done; then the limit
+positions and normals of its corners are interpolated.
+
+How to use it?
+> mesh = CompactMesh.from_file("suzanne.off")
+> positions, normals = limit_frames(mesh, "CC")
+> smooth = project(mesh, "CC")                   # same faces, vertices on the limit surface
+> quads = mesh.subdivision_CC()
+> points, du, dv, normals = evaluate(quads, "CC", faces, u, v)
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+from compact import CompactMesh, EDGE, FACE
+from adaptive import face_normals
+
+face_sizes = {"CC": 4, "LOOP": 3}
+regular_valence = {"CC": 4, "LOOP": 6}
+
+# corners of the children of a face in (u, v) of the face, in stencil order
+quad = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=float)
+triangle = np.array([[0, 0], [1, 0], [0, 1]], dtype=float)
+children_corners = {
+    "CC": [[(quad[k] + quad[(k + 1) % 4]) / 2, quad[(k + 1) % 4], (quad[(k + 1) % 4] + quad[(k + 2) % 4]) / 2, [0.5, 0.5]] for k in range(4)],
+    "LOOP": [[(triangle[k] + triangle[(k + 1) % 3]) / 2 for k in range(3)]]
+            + [[(triangle[k] + triangle[(k + 1) % 3]) / 2, triangle[(k + 1) % 3], (triangle[(k + 1) % 3] + triangle[(k + 2) % 3]) / 2] for k in range(3)],
+}
+
+
+def prepared(mesh, algorithm):
+    """mesh itself if it has only quads (CC) or triangles (LOOP), else its next level (vertices keep their numbers)."""
+    if algorithm not in face_sizes: raise Exception("limit surface supports only CC and LOOP")
+    if np.all(mesh.face_sizes == face_sizes[algorithm]): return mesh
+    return getattr(mesh, "subdivision_" + algorithm)()
+
+
+def vertex_masks(mesh, algorithm):
+    """[(vertices, rings, masks)]: groups of vertices with the same kind of ring, their (G, r) rings and
+    (3, r) limit, tangent and tangent masks. Vertices without a manifold ring are in no group."""
+    he = mesh.halfedges
+    n = mesh.vertex_count
+    offsets, corners, flips, closed = he.vertex_rings()
+    sizes = np.diff(offsets)
+    stencil = getattr(mesh, "stencil_" + algorithm)()
+    complete = (sizes > 0) & (sizes == np.bincount(he.origin, minlength=n))
+
+    groups = []
+    for size, is_closed in sorted(set(zip(sizes[complete].tolist(), closed[complete].tolist()))):
+        vertices = np.flatnonzero(complete & (sizes == size) & (closed == is_closed))
+        ring_corners = corners[offsets[vertices][:, None] + np.arange(size)]
+        flip = flips[offsets[vertices][:, None] + np.arange(size)]
+        edges = he.edge[np.where(flip, he.prev[ring_corners], ring_corners)]
+        if not is_closed:
+            edges = np.concatenate([he.edge[np.where(flip[:, :1], ring_corners[:, :1], he.prev[ring_corners[:, :1]])], edges], axis=1)
+        ends = he.edge_vertices[edges]
+        rings = [vertices[:, None], np.where(ends[..., 0] == vertices[:, None], ends[..., 1], ends[..., 0])]
+        rows = [vertices[:, None], stencil.block_offset(EDGE) + edges]
+        if algorithm == "CC":
+            rings.append(he.origin[he.next[he.next[ring_corners]]])
+            rows.append(stencil.block_offset(FACE) + he.face[ring_corners])
+        rings, rows = np.concatenate(rings, axis=1), np.concatenate(rows, axis=1)
+
+        # rings that meet themselves (tiny closed meshes) have no matrix of their own
+        ordered = np.sort(rings, axis=1)
+        simple = np.all(ordered[:, 1:] != ordered[:, :-1], axis=1)
+        vertices, rings, rows = vertices[simple], rings[simple], rows[simple]
+        if not len(vertices): continue
+
+        matrix = stencil.matrix[rows[0]]
+        local = matrix[:, rings[0]].toarray()
+        if not np.allclose(local.sum(axis=1), matrix.sum(axis=1).A1): continue
+
+        values, vectors = np.linalg.eig(local.T)
+        order = np.argsort(-np.abs(values), kind="stable")
+        values, vectors = values[order], vectors[:, order]
+        limit = vectors[:, 0].real / vectors[:, 0].real.sum()
+        if abs(values[1].imag) > 1e-12: tangents = [vectors[:, 1].real, vectors[:, 1].imag]
+        else: tangents = [vectors[:, 1].real, vectors[:, 2].real] if size > 1 else [vectors[:, 1].real] * 2
+        groups.append((vertices, rings, np.stack([limit, *tangents])))
+    return groups
+
+
+def vertex_normals(mesh):
+    he = mesh.halfedges
+    normals = np.zeros((mesh.vertex_count, 3))
+    np.add.at(normals, he.origin, face_normals(mesh)[he.face])
+    return normals / np.maximum(np.linalg.norm(normals, axis=1), 1e-300)[:, None]
+
+
+def limit_frames(mesh, algorithm):
+    """(positions, normals) of the vertices of mesh on the limit surface. Vertices with a non-manifold
+    ring keep the positions of the first level with only quads/triangles."""
+    level = prepared(mesh, algorithm)
+    positions = level.positions.copy()
+    normals = vertex_normals(level)
+    for vertices, rings, masks in vertex_masks(level, algorithm):
+        points = np.einsum("kr,grd->kgd", masks, level.positions[rings])
+        positions[vertices] = points[0]
+        cross = np.cross(points[1], points[2])
+        cross /= np.maximum(np.linalg.norm(cross, axis=1), 1e-300)[:, None]
+        sign = np.where(np.einsum("ij,ij->i", cross, normals[vertices]) < 0, -1, 1)
+        normals[vertices] = np.where(np.linalg.norm(cross, axis=1)[:, None] > 0, cross * sign[:, None], normals[vertices])
+    return positions[:mesh.vertex_count], normals[:mesh.vertex_count]
+
+
+def limit_positions(mesh, algorithm): return limit_frames(mesh, algorithm)[0]
+
+
+def project(mesh, algorithm):
+    """The same mesh with its vertices moved onto the limit surface."""
+    return CompactMesh(limit_positions(mesh, algorithm), mesh.face_indices, mesh.face_offsets)
+
+
+def limit_matrix(mesh, algorithm):
+    """Sparse matrix of the limit positions of mesh (only quads/triangles) from its positions."""
+    rows, columns, values = [np.arange(mesh.vertex_count)], [np.arange(mesh.vertex_count)], [np.ones(mesh.vertex_count)]
+    for vertices, rings, masks in vertex_masks(mesh, algorithm):
+        values[0][vertices] = 0
+        rows.append(np.repeat(vertices, rings.shape[1]))
+        columns.append(rings.ravel())
+        values.append(np.tile(masks[0], len(vertices)))
+    return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape=(mesh.vertex_count, mesh.vertex_count))
+
+
+# exact evaluation of regular patches: Catmull-Clark quads are bicubic B-splines, Loop
+# triangles quartic box splines
+
+def bspline(t):
+    """Uniform cubic B-spline basis functions and their derivatives at t, (4, len(t)) each."""
+    s = 1 - t
+    values = np.stack([s**3, 3*t**3 - 6*t**2 + 4, -3*t**3 + 3*t**2 + 3*t + 1, t**3]) / 6
+    derivatives = np.stack([-s**2, 3*t**2 - 4*t, -3*t**2 + 2*t + 1, t**2]) / 2
+    return values, derivatives
+
+
+quartic_exponents = np.array([(a, b) for a in range(5) for b in range(5 - a)])
+
+def quartic(u, v):
+    """Monomials u^a v^b (a + b <= 4) and their derivatives along u and v, (len(u), 15) each."""
+    a, b = quartic_exponents.T
+    u, v = u[:, None], v[:, None]
+    return u**a * v**b, a * u**np.maximum(a - 1, 0) * v**b, b * u**a * v**np.maximum(b - 1, 0)
+
+
+# control vertices of a regular triangle (0, 0), (1, 0), (0, 1) on the triangle lattice
+# with edges along (1, 0), (0, 1) and (-1, 1)
+loop_lattice = [(0, 0), (1, 0), (0, 1), (1, -1), (1, 1), (-1, 1), (2, -1), (0, -1), (2, 0), (0, 2), (-1, 2), (-1, 0)]
+
+_loop_patch = None
+
+def loop_patch():
+    """(15, 12) coefficients of the limit of a regular Loop triangle in the quartic() monomials, per control vertex.
+
+    The limit is a quartic polynomial on every triangle of a regular lattice, so it is fitted to the limit
+    positions of the scheme itself at the quarter points of a triangle of a flat lattice mesh."""
+    global _loop_patch
+    if _loop_patch is None:
+        from stencil import SubdivisionOperator
+        side = np.arange(-4, 6)
+        i, j = [a.ravel() for a in np.meshgrid(side, side, indexing="ij")]
+        number = lambda a, b: (a + 4) * len(side) + b + 4
+        cells = (i < side[-1]) & (j < side[-1])
+        ci, cj = i[cells], j[cells]
+        triangles = np.concatenate([np.stack([number(ci, cj), number(ci + 1, cj), number(ci, cj + 1)], axis=1),
+                                    np.stack([number(ci + 1, cj), number(ci + 1, cj + 1), number(ci, cj + 1)], axis=1)])
+        lattice = CompactMesh(np.stack([i, j, np.zeros(len(i))], axis=1), triangles.ravel(), np.arange(0, triangles.size + 1, 3))
+
+        operator = SubdivisionOperator(lattice, "LOOP", 2)
+        level = operator.mesh(lattice.positions)
+        limits = limit_matrix(level, "LOOP") @ operator.matrix
+        quarters = np.array([(a, b) for a in range(5) for b in range(5 - a)]) / 4
+        rows = [int(np.argmin(np.abs(level.positions[:, :2] - point).sum(axis=1))) for point in quarters]
+        columns = [number(a, b) for a, b in loop_lattice]
+        _loop_patch = np.linalg.solve(quartic(quarters[:, 0], quarters[:, 1])[0], limits[rows][:, columns].toarray())
+    return _loop_patch
+
+
+def regular_faces(mesh, valence):
+    """Faces whose corners all have valence faces around them and no boundary."""
+    he = mesh.halfedges
+    offsets, _, _, closed = he.vertex_rings()
+    regular_vertex = closed & (np.diff(offsets) == valence) & (np.bincount(he.origin, minlength=mesh.vertex_count) == valence)
+    return np.bincount(he.face, weights=regular_vertex[he.origin], minlength=mesh.face_count) == mesh.face_sizes
+
+
+def face_corners(mesh, faces):
+    size = int(mesh.face_sizes[0])
+    return mesh.face_indices[mesh.face_offsets[faces][:, None] + np.arange(size)]
+
+
+def next_to(mesh, faces, x, y):
+    """Corner of every quad next to x that is not y."""
+    corners = face_corners(mesh, faces)
+    k = np.argmax(corners == x[:, None], axis=1)
+    m = np.argmax(corners == y[:, None], axis=1)
+    return corners[np.arange(len(faces)), (2 * k - m) % 4]
+
+
+def third(mesh, faces, x, y):
+    """Corner of every triangle that is not x or y."""
+    return face_corners(mesh, faces).sum(axis=1) - x - y
+
+
+def across(mesh, faces, x, y):
+    """Face on the other side of edge (x, y) of every face."""
+    he = mesh.halfedges
+    corners = face_corners(mesh, faces)
+    size = corners.shape[1]
+    k = np.argmax(corners == x[:, None], axis=1)
+    m = np.argmax(corners == y[:, None], axis=1)
+    halfedge = mesh.face_offsets[faces] + np.where(m == (k + 1) % size, k, m)
+    return he.face[he.twin[halfedge]]
+
+
+def control_grid(mesh, faces):
+    """(len(faces), 4, 4) B-spline control vertices of regular quads, [i][j] along (u, v)."""
+    c0, c1, c2, c3 = face_corners(mesh, faces).T
+    grid = np.empty((len(faces), 4, 4), dtype=np.int64)
+    grid[:, 1, 1], grid[:, 2, 1], grid[:, 2, 2], grid[:, 1, 2] = c0, c1, c2, c3
+    sides = []
+    for (i, j), (k, l), a, b in [((1, 0), (2, 0), c0, c1), ((3, 1), (3, 2), c1, c2), ((2, 3), (1, 3), c2, c3), ((0, 2), (0, 1), c3, c0)]:
+        side = across(mesh, faces, a, b)
+        grid[:, i, j] = next_to(mesh, side, a, b)
+        grid[:, k, l] = next_to(mesh, side, b, a)
+        sides.append(side)
+    for (i, j), side, a, (k, l) in [((0, 0), sides[0], c0, (1, 0)), ((3, 0), sides[0], c1, (2, 0)),
+                                    ((3, 3), sides[2], c2, (2, 3)), ((0, 3), sides[2], c3, (1, 3))]:
+        grid[:, i, j] = next_to(mesh, across(mesh, side, a, grid[:, k, l]), grid[:, k, l], a)
+    return grid
+
+
+def control_triangles(mesh, faces):
+    """(len(faces), 12) box spline control vertices of regular triangles, in loop_lattice order."""
+    c0, c1, c2 = face_corners(mesh, faces).T
+    points = [c0, c1, c2]
+    sides = []
+    for a, b in [(c0, c1), (c1, c2), (c2, c0)]:
+        sides.append(across(mesh, faces, a, b))
+        points.append(third(mesh, sides[-1], a, b))
+    for side, opposite, a, b in [(sides[0], points[3], c1, c0), (sides[1], points[4], c1, c2), (sides[2], points[5], c2, c0)]:
+        points.append(third(mesh, across(mesh, side, a, opposite), a, opposite))
+        points.append(third(mesh, across(mesh, side, b, opposite), b, opposite))
+    return np.stack(points, axis=1)
+
+
+def evaluate_regular(mesh, algorithm, faces, u, v):
+    if algorithm == "CC":
+        points = mesh.positions[control_grid(mesh, faces)]
+        bu, du = bspline(u)
+        bv, dv = bspline(v)
+        return (np.einsum("iq,jq,qijd->qd", bu, bv, points), np.einsum("iq,jq,qijd->qd", du, bv, points),
+                np.einsum("iq,jq,qijd->qd", bu, dv, points))
+    points = np.einsum("mc,qcd->qmd", loop_patch(), mesh.positions[control_triangles(mesh, faces)])
+    return tuple(np.einsum("qm,qmd->qd", basis, points) for basis in quartic(u, v))
+
+
+def evaluate_corners(mesh, algorithm, faces, u, v):
+    """Interpolation of the limit positions and normals of the corners of the faces."""
+    positions, normals = limit_frames(mesh, algorithm)
+    corners = mesh.face_indices[mesh.face_offsets[faces][:, None] + np.arange(face_sizes[algorithm])]
+    p, m = positions[corners], normals[corners]
+    if algorithm == "CC":
+        weights = np.stack([(1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v], axis=1)
+        du = (1 - v)[:, None] * (p[:, 1] - p[:, 0]) + v[:, None] * (p[:, 2] - p[:, 3])
+        dv = (1 - u)[:, None] * (p[:, 3] - p[:, 0]) + u[:, None] * (p[:, 2] - p[:, 1])
+    else:
+        weights = np.stack([1 - u - v, u, v], axis=1)
+        du, dv = p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]
+    normals = np.einsum("qk,qkd->qd", weights, m)
+    return np.einsum("qk,qkd->qd", weights, p), du, dv, normals
+
+
+def child_number(algorithm, u, v):
+    if algorithm == "CC":
+        corner = np.where(v < 0.5, np.where(u < 0.5, 0, 1), np.where(u < 0.5, 3, 2))
+        return (corner - 1) % 4
+    w = 1 - u - v
+    return np.where(u > 0.5, 1, np.where(v > 0.5, 2, np.where(w > 0.5, 3, 0)))
+
+
+def child_maps(algorithm):
+    """(origins, inverses) of the affine maps of the children: child params = inverse @ (params - origin)."""
+    corners = np.array(children_corners[algorithm], dtype=float)
+    axes = np.stack([corners[:, 1] - corners[:, 0], corners[:, -1] - corners[:, 0]], axis=2)
+    return corners[:, 0], np.linalg.inv(axes)
+
+
+batch_size = 1 << 14
+
+def evaluate(mesh, algorithm, faces, u, v, depth=10):
+    """(positions, du, dv, normals) of the limit surface at parameters (u, v) of the faces.
+
+    mesh has only quads (CC, u along the first edge, v along the last one) or triangles (LOOP, the
+    point is (1-u-v)*first + u*second + v*third corner). Points are done in batches of nearby faces."""
+    if np.any(mesh.face_sizes != face_sizes[algorithm]): raise Exception(f"evaluate needs a mesh with faces of {face_sizes[algorithm]} vertices")
+    faces, u, v = np.broadcast_arrays(np.asarray(faces, dtype=np.int64), np.asarray(u, dtype=float), np.asarray(v, dtype=float))
+    faces, params = faces.reshape(-1), np.stack([u.reshape(-1), v.reshape(-1)], axis=1)
+    results = [np.empty((len(faces), 3)) for i in range(4)]
+    order = np.argsort(faces, kind="stable")
+    for start in range(0, len(faces), batch_size):
+        batch = order[start:start + batch_size]
+        for result, values in zip(results, evaluate_batch(mesh, algorithm, faces[batch], params[batch], depth)):
+            result[batch] = values
+    return tuple(results)
+
+
+def evaluate_batch(mesh, algorithm, faces, params, depth):
+    faces, params = faces.copy(), params.copy()
+    jacobians = np.broadcast_to(np.eye(2), (len(faces), 2, 2)).copy()   # d(params)/d(u, v)
+    positions, derivatives, normals = np.empty((len(faces), 3)), np.empty((len(faces), 2, 3)), np.empty((len(faces), 3))
+    origins, inverses = child_maps(algorithm)
+
+    pending = np.arange(len(faces))
+    level = mesh
+    for step in range(depth + 1):
+        done = pending[regular_faces(level, regular_valence[algorithm])[faces[pending]]]
+        if len(done):
+            p, du, dv = evaluate_regular(level, algorithm, faces[done], params[done, 0], params[done, 1])
+            positions[done] = p
+            derivatives[done] = np.stack([du, dv], axis=1)
+            normals[done] = np.cross(du, dv)
+        pending = np.setdiff1d(pending, done)
+        if not len(pending): break
+
+        if step == depth:
+            p, du, dv, m = evaluate_corners(level, algorithm, faces[pending], params[pending, 0], params[pending, 1])
+            positions[pending] = p
+            derivatives[pending] = np.stack([du, dv], axis=1)
+            normals[pending] = m * np.where(np.einsum("ij,ij->i", m, np.cross(du, dv)) < 0, -1, 1)[:, None]
+            break
+
+        # refine the faces with pending points (and the faces around them) and go to the children
+        around = level.neighbourhood(np.unique(faces[pending]))
+        local, _ = level.submesh(around)
+        stencil = getattr(local, "stencil_" + algorithm)()
+        child = child_number(algorithm, params[pending, 0], params[pending, 1])
+        faces[pending] = np.searchsorted(stencil.face_major, np.searchsorted(around, faces[pending])) + child
+        params[pending] = np.einsum("qij,qj->qi", inverses[child], params[pending] - origins[child])
+        jacobians[pending] = np.einsum("qij,qjk->qik", inverses[child], jacobians[pending])
+        level = local.refine(stencil)
+
+    # derivatives along (u, v) of the original faces
+    derivatives = np.einsum("qid,qij->qjd", derivatives, jacobians)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-300)[:, None]
+    return positions, derivatives[:, 0], derivatives[:, 1], normals
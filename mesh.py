@@ -1,4 +1,4 @@
-"""Library implements 4 mesh subdivision algorithms (support only .off files):
+"""Library implements 4 mesh subdivision algorithms (support .off files and .npz checkpoints):
 - Doo–Sabin (mesh.subdivision_DS())
 - Catmull–Clark (mesh.subdivision_CC())
 - Loop (mesh.subdivision_LOOP())
@@ -8,42 +8,51 @@ How to use it?
 > mesh = Mesh(filename="cube.off")
 > mesh2 = mesh.subdivision_CC()
 > mesh2.save(cube_smooth.off) 
+> mesh2.save("cube_smooth.off", binary=True)   # binary .off, or mesh2.save("cube_smooth.npz")
+> mesh3 = mesh2.subdivision_CC(workers=8)      # in 8 processes, see parallel.py
+> kind, element = mesh2.parent(10)            # vertex 10 of mesh2 is the point of that element of mesh
 """
 
 import copy
 import random
-import itertools
-import time
 import math
+import warnings
 
-global_counter = itertools.count(10000)
+import numpy as np
 
-class Vertex:
-    def __init__(self, x, y, z, faces = None, id = None):
+import off
+import profiling
+
+# kinds of elements of a level that new vertices come from (also of compact.Stencil.blocks)
+VERTEX, EDGE, FACE, CORNER = range(4)
+
+class Point:
+    """Position without id and faces: the result of Vertex arithmetic, a Vertex only once it goes into a mesh (to_vertex)."""
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
         self.x = x
         self.y = y
         self.z = z
-        self.faces = faces if faces else []
-        self.id = id or next(global_counter)
 
-    def copy(self, id=None):
+    def to_vertex(self, id=None):
         return Vertex(self.x, self.y, self.z, [], id)
 
-    def __str__(self): return f"{self.id-1}:({round(self.x,2)},{round(self.y,2)},{round(self.z,2)})"
+    def __str__(self): return f"({round(self.x,2)},{round(self.y,2)},{round(self.z,2)})"
 
     def dist(self, other): return ((self.x - other.x)**2 + (self.y - other.y)**2 + (self.z - other.z)**2)**(1/2)
 
     def __add__(self, other):
-        return Vertex(self.x + other.x, self.y + other.y, self.z + other.z)
+        return Point(self.x + other.x, self.y + other.y, self.z + other.z)
 
     def __neg__(self):
-        return Vertex(-self.x, -self.y, -self.z)
+        return Point(-self.x, -self.y, -self.z)
 
     def __sub__(self, other):
-        return Vertex(self.x - other.x, self.y - other.y, self.z - other.z)
+        return Point(self.x - other.x, self.y - other.y, self.z - other.z)
 
     def __mul__(self, num):
-        return Vertex(num * self.x, num * self.y, num * self.z)
+        return Point(num * self.x, num * self.y, num * self.z)
 
     def __truediv__(self, num):
         return self * (1/num)
@@ -51,61 +60,94 @@ class Vertex:
     def midpoint(self, other):
         return (self + other) * 1/2
 
-    def repair_faces_order(self):
-        if self.faces == []: return
+    def accumulate(self, other):
+        """self += other in place (only for Points owned by the caller, like the total of centroid)."""
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
 
-        if len(self.faces) != len(list(set(self.faces))):
-            print(self)
-            print(*self.faces)
-            raise Exception("Bad structure detected (mesh probably have redundant faces)")
+def centroid(points):
+    """Average of the points, summed in place into one Point."""
+    total = Point(0, 0, 0)
+    for p in points: total.accumulate(p)
+    return total * (1/len(points))
 
-        faces = copy.copy(self.faces)
-        result = [faces.pop(0)]
+class Vertex(Point):
+    """id: number of the vertex in its mesh, given once when it is created (the subdivisions number the new
+    vertices by the elements they come from, see Mesh.parent); vertices without id are hashed by identity."""
 
-        counter = itertools.count()
+    def __init__(self, x, y, z, faces = None, id = None):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.faces = faces if faces else []
+        self.id = id
 
-        limit = len(self.faces)**2
+    def copy(self, id=None):
+        return Vertex(self.x, self.y, self.z, [], id)
 
-        while faces:
-            face = faces.pop(0)
-            if face in result[-1].get_neighbours():
-                result.append(face)
-            else:
-                faces.append(face)
-                if next(counter) == limit:
-                    result.reverse()
-                if next(counter) == 2 * limit:
-                    print(*self.faces)
-                    return
-                if next(counter) == 1000:
-                    print(*self.faces)
-                    raise Exception(f"Bad structure detected (faces around vertex {self} aren't consistent)")
-
-        self.faces = result
+    def __str__(self): return f"{self.id}:({round(self.x,2)},{round(self.y,2)},{round(self.z,2)})"
+
+    def repair_faces_order(self):
+        if self.faces == []: return
+
+        if len(self.faces) != len(list(set(self.faces))):
+            raise Exception(f"Bad structure detected around vertex {self} (mesh probably have redundant faces)")
+
+        # edge-adjacency index of the one-ring: neighbour vertex -> faces sharing the edge with it
+        sides = {}
+        edges = {}
+        for face in self.faces:
+            idx = face.vertices.index(self)
+            sides[face] = (face.vertices[(idx + 1) % len(face.vertices)], face.vertices[idx - 1])
+            for v in sides[face]:
+                edges.setdefault(v, []).append(face)
+
+        # open fans (boundary vertices) are walked from the face lying on the boundary
+        starts = [(face, sides[face][0]) for face in self.faces if len(edges[sides[face][0]]) == 1]
+        starts += [(face, sides[face][1]) for face in self.faces if len(edges[sides[face][1]]) == 1]
+        start, entry = (starts or [(self.faces[0], sides[self.faces[0]][0])])[0]
+
+        result = [start]
+        face = start
+        while len(result) < len(self.faces):
+            exit = sides[face][1] if entry is sides[face][0] else sides[face][0]
+            following = [f for f in edges[exit] if f is not face]
+            if not following or following[0] is start: break
+            face, entry = following[0], exit
+            result.append(face)
+
+        # faces of another fan (non-manifold vertex) are kept at the end
+        visited = set(result)
+        self.faces = result + [face for face in self.faces if face not in visited]
 
     def get_neighbours(self):
-        result = set()
+        # in the order of the faces, so the sums over them don't depend on hashes
+        result = {}
 
         for face in self.faces:
             idx = face.vertices.index(self)
-            result.add(face.vertices[idx - 1])
-            result.add(face.vertices[(idx + 1) % len(face.vertices)])
+            result[face.vertices[idx - 1]] = None
+            result[face.vertices[(idx + 1) % len(face.vertices)]] = None
 
         return list(result)
 
     def __hash__(self) -> int:
-        return self.id
+        return object.__hash__(self) if self.id is None else self.id
 
 class Face:
     def __init__(self, vertices = None):
         self.vertices = vertices if vertices else []
-        for v in self.vertices:
-            if self.vertices.count(v)>1:
-                self.vertices.remove(v)
+        # (only faces with repeated vertices pay for the quadratic scan, see validate.py)
+        if len(set(self.vertices)) < len(self.vertices):
+            for v in self.vertices:
+                if self.vertices.count(v)>1:
+                    self.vertices.remove(v)
         for v in self.vertices:
             v.faces.append(self)
         if self.vertices:
-            self.center = Vertex(sum([v.x for v in self.vertices]), sum([v.y for v in self.vertices]), sum([v.z for v in self.vertices])) * (1/len(self.vertices))
+            self.center = centroid(self.vertices)
         self.inside_points = {}
         self.midpoints = {}
         self.neighbours = []
@@ -125,13 +167,16 @@ class Face:
             self.neighbours = result
             return result
 
-    def get_inside_points(self):
+    def get_inside_points(self, first_id=None):
+        """Point of every corner (from the second one); first_id: id of the point of the first corner, the others follow."""
         if self.inside_points != {}:
             return self.inside_points
         else:
             result = {}
-            for v1, v2, v3 in zip(self.vertices, self.vertices[1:] + self.vertices[:1], self.vertices[2:] + self.vertices[:2]):
-                result[v2] = ((v1+v3)/2 + v2 * 2 + self.center)/4
+            n = len(self.vertices)
+            for i, (v1, v2, v3) in enumerate(zip(self.vertices, self.vertices[1:] + self.vertices[:1], self.vertices[2:] + self.vertices[:2])):
+                id = None if first_id is None else first_id + (i + 1) % n
+                result[v2] = (((v1+v3)/2 + v2 * 2 + self.center)/4).to_vertex(id)
             self.inside_points = result
             return result
 
@@ -155,7 +200,11 @@ class Face:
         return result[:2]
 
 class Mesh:
-    def __init__(self, *, vertices = None, faces = None, filename = None, triangular=False):
+    """blocks: [(kind, count)] of the vertices of a subdivision, one vertex per vertex/edge/face/corner of
+    the mesh it comes from, numbered by those elements (like compact.Stencil.blocks), None otherwise."""
+
+    def __init__(self, *, vertices = None, faces = None, filename = None, triangular=False, blocks = None):
+        self.blocks = blocks
         if vertices is None and faces is None:
             self.vertices = []
             self.faces = []
@@ -163,80 +212,67 @@ class Mesh:
             self.vertices = vertices
             self.faces = faces
         if filename is not None:
-            if filename.split(".")[-1] != "off": raise Exception("mesh support only .off files")
-            
-            with open(filename) as f:
-                lines = f.readlines()
-
-            vertices_count = 0
-            edges_count = 0
-            faces_count = 0
-
-            import re
-            while True:
-                line = lines.pop(0)
-                if re.compile(r" *\d+ +\d+ +\d+( +\d+)? *").search(line):
-                    nums = [int(num) for num in line.strip().split(" ") if num]
-                    vertices_count = nums[0]
-                    faces_count = nums[-2]
-                    if len(nums) > 3: edges_count = nums[1]
-                    break
-
-            vertices = {}
-
-            for i in range(vertices_count):
-                line = lines.pop(0)
-                x, y, z, *sth = [float(num) for num in line.strip().split(" ") if num]
-                vertices[i] = Vertex(x,y,z,id=i)
-
-            for i in range(edges_count): lines.pop(0)
-
-            for i in range(faces_count):
-                line = lines.pop(0)
-                c, *vs = [int(num) for num in line.strip().split(" ") if num]
-                if c != 3 and triangular:
-                    vs = list(map(lambda num: vertices[num], vs))
-                    main = vs.pop(0)
-                    for v1, v2 in zip(vs, vs[1:]):
-                        self.faces.append(Face([main, v1, v2]))
-                else:
-                    self.faces.append(Face(list(map(lambda num: vertices[num], vs))))
-                # for v in vs: vertices[v].faces.append(f)
-
-            self.vertices += vertices.values()
-        tmp = []
-        for face in self.faces:
-            if len(list(set(face.vertices))) < 3:
-                for v in face.vertices:
-                    v.faces.remove(face)
-            else: tmp.append(face)
-        self.faces = tmp
-        self.vertices = list(filter(lambda v: len(v.faces) > 0, self.vertices))
+            with profiling.phase("Mesh.read") as phase:
+                positions, face_indices, face_offsets = off.read_mesh(filename, triangular)
+                vertices = [Vertex(x, y, z, id=i) for i, (x, y, z) in enumerate(positions.tolist())]
+                face_indices = face_indices.tolist()
+                face_offsets = face_offsets.tolist()
+                for start, end in zip(face_offsets, face_offsets[1:]):
+                    self.faces.append(Face([vertices[i] for i in face_indices[start:end]]))
+
+                self.vertices += vertices
+                phase.count(vertices=len(vertices), faces=len(self.faces))
+        with profiling.phase("Mesh.cleanup") as phase:
+            tmp = []
+            for face in self.faces:
+                if len(list(set(face.vertices))) < 3:
+                    for v in face.vertices:
+                        v.faces.remove(face)
+                else: tmp.append(face)
+            phase.count(removed_faces=len(self.faces) - len(tmp))
+            self.faces = tmp
+            self.vertices = list(filter(lambda v: len(v.faces) > 0, self.vertices))
 
 
     def __str__(self):
         return f"vertices:\n{list(map(str, self.vertices))}\nfaces:\n{list(map(lambda f: list(map(lambda v: v.id, f.vertices)), self.faces))}"
 
-    def save(self, filename):
-        file = open(filename, "w+")
-        print("OFF", file=file)
-        print(len(self.vertices), len(self.faces), 0, file=file)
-        mapping = {}
-        for i, v in enumerate(sorted(self.vertices, key=lambda v: v.id)):
-            mapping[v.id] = i
-            print(v.x, v.y, v.z, file=file)
-        
-        for f in self.faces:
-            print(len(f.vertices), *list(map(lambda v: mapping[v.id], f.vertices)), file=file)
+    def parent(self, id):
+        """(kind, number) of the element of the mesh before the subdivision that vertex id comes from: vertices,
+        faces and corners (face by face) are numbered by their order there, edges by their first appearance."""
+        for kind, count in self.blocks or []:
+            if id < count: return kind, id
+            id -= count
+        raise Exception(f"no vertex {id} in the blocks {self.blocks}")
+
+    def to_arrays(self):
+        # keyed by the vertices themselves: hand-built ones have no ids
+        mapping = {v: i for i, v in enumerate(self.vertices)}
+        positions = np.array([(v.x, v.y, v.z) for v in self.vertices], dtype=float).reshape(-1, 3)
+        face_offsets = np.concatenate([[0], np.cumsum([len(f.vertices) for f in self.faces], dtype=np.int64)])
+        face_indices = np.fromiter((mapping[v] for f in self.faces for v in f.vertices), dtype=np.int64, count=int(face_offsets[-1]))
+        return positions, face_indices, face_offsets
+
+    def save(self, filename, binary=False, decimals=None):
+        off.write_mesh(filename, *self.to_arrays(), binary, decimals)
 
     def save_faces_separately(self):
         for i, face in enumerate(self.faces):
             Mesh(vertices=face.vertices, faces=[face]).save(f"tmp/face{i}.off")
 
-    def subdivision_DS(self):
-        new_vertices = sum([list(face.get_inside_points().values()) for face in self.faces],[])
-        counter = itertools.count()
-        for v in new_vertices: v.id = next(counter)
+    def subdivision_parallel(self, algorithm, workers=None):
+        from compact import CompactMesh
+        return CompactMesh.from_mesh(self).subdivision_parallel(algorithm, workers).to_mesh()
+
+    def subdivision_DS(self, workers=1):
+        if workers != 1: return self.subdivision_parallel("DS", workers)
+        with profiling.phase("DS.inside_points") as phase:
+            # one point per corner, numbered by the corners
+            new_vertices = []
+            for face in self.faces:
+                inside_points = face.get_inside_points(len(new_vertices))
+                new_vertices += [inside_points[v] for v in face.vertices]
+            phase.count(vertices=len(new_vertices))
         
         new_faces = []
         
@@ -244,76 +280,90 @@ class Mesh:
         old_faces = copy.copy(self.faces)
         done_edges = set()
 
-        for face in old_faces:
-            new_faces.append(Face(list(face.get_inside_points().values())))
-            for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
-                if (v1.id, v2.id) not in done_edges and (v2.id, v1.id) not in done_edges:
-                    done_edges.add((v1.id, v2.id))
-                    tmp = set().union(v1.faces).intersection(v2.faces).difference([face])
-                    if tmp != set():
-                        neighbour = tmp.pop()
-                        new_faces.append(Face(
-                            [face.get_inside_points()[v1],
-                            face.get_inside_points()[v2],
-                            neighbour.get_inside_points()[v2],
-                            neighbour.get_inside_points()[v1],
-                            ]))
-        
-        for vertice in old_vertices:
-            if len(vertice.faces) < 3: continue
-            vertice.repair_faces_order()
-            new_faces.append(Face([face.get_inside_points()[vertice] for face in vertice.faces]))
+        with profiling.phase("DS.faces") as phase:
+            for face in old_faces:
+                new_faces.append(Face(list(face.get_inside_points().values())))
+                for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
+                    if (v1, v2) not in done_edges and (v2, v1) not in done_edges:
+                        done_edges.add((v1, v2))
+                        tmp = set().union(v1.faces).intersection(v2.faces).difference([face])
+                        if tmp != set():
+                            neighbour = tmp.pop()
+                            new_faces.append(Face(
+                                [face.get_inside_points()[v2],
+                                face.get_inside_points()[v1],
+                                neighbour.get_inside_points()[v1],
+                                neighbour.get_inside_points()[v2],
+                                ]))
+            phase.count(faces=len(new_faces), edges=len(done_edges))
+
+        vertices = [vertice for vertice in old_vertices if len(vertice.faces) >= 3]
+        with profiling.phase("repair_faces_order") as phase:
+            for vertice in vertices: vertice.repair_faces_order()
+            phase.count(vertices=len(vertices))
+
+        with profiling.phase("DS.vertex_faces") as phase:
+            for vertice in vertices:
+                new_faces.append(Face([face.get_inside_points()[vertice] for face in vertice.faces]))
+            phase.count(faces=len(vertices))
                     
 
-        return Mesh(vertices=new_vertices, faces=new_faces)
+        return Mesh(vertices=new_vertices, faces=new_faces, blocks=[(CORNER, len(new_vertices))])
 
-    def subdivision_CC(self):
+    def subdivision_CC(self, workers=1):
+        if workers != 1: return self.subdivision_parallel("CC", workers)
 
         edge_points = {}
         vertex_points = {}
-
-        for face in self.faces:
-            for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
-                if (v1, v2) in edge_points.keys() or (v2, v1) in edge_points.keys(): continue
-                neighbour = face.get_neighbour(v1,v2) #or face.get_neighbour(v2,v1)
-                if neighbour:
-                    v = (v1 + v2 + face.center + neighbour.center)/4
-                    edge_points[(v1,v2)] = v  
-                else:
-                    v = (v1 + v2 + face.center)/3
-                    edge_points[(v1,v2)] = v 
-
-        for v in self.vertices:
-            # esc = Face([(edge_points.get((v1,v), None) or edge_points.get((v,v1), None) or print(v, v1)) for v1 in v.get_neighbours()]).center
-            # fsc = Face([face.center for face in v.faces]).center
-            esc = sum([(v + v1) / 2 for v1 in v.get_neighbours()], Vertex(0,0,0)) / (len(v.get_neighbours()))
-            fsc = sum([face.center for face in v.faces], Vertex(0,0,0)) / (len(v.faces))
-            n = len(v.faces)#?
-            vertex_points[v] = ((v * (n-3)) + (esc * 2) + fsc) / n
-            # print(n, "    ", esc, "    ", fsc, "    ", ((v * (n-3)) + (esc * 2) + fsc) / n)
+        n_vertices = len(self.vertices)
+
+        with profiling.phase("CC.edge_points") as phase:
+            for face in self.faces:
+                for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
+                    if (v1, v2) in edge_points.keys() or (v2, v1) in edge_points.keys(): continue
+                    neighbour = face.get_neighbour(v1,v2) #or face.get_neighbour(v2,v1)
+                    # numbered after the vertex points, by the first appearance of the edge
+                    id = n_vertices + len(edge_points)
+                    if neighbour:
+                        v = ((v1 + v2 + face.center + neighbour.center)/4).to_vertex(id)
+                        edge_points[(v1,v2)] = v  
+                    else:
+                        v = ((v1 + v2 + face.center)/3).to_vertex(id)
+                        edge_points[(v1,v2)] = v 
+            phase.count(edge_points=len(edge_points))
+
+        with profiling.phase("CC.vertex_points") as phase:
+            for i, v in enumerate(self.vertices):
+                # esc = Face([(edge_points.get((v1,v), None) or edge_points.get((v,v1), None) or print(v, v1)) for v1 in v.get_neighbours()]).center
+                # fsc = Face([face.center for face in v.faces]).center
+                esc = centroid([(v + v1) / 2 for v1 in v.get_neighbours()])
+                fsc = centroid([face.center for face in v.faces])
+                n = len(v.faces)#?
+                vertex_points[v] = (((v * (n-3)) + (esc * 2) + fsc) / n).to_vertex(i)
+                # print(n, "    ", esc, "    ", fsc, "    ", ((v * (n-3)) + (esc * 2) + fsc) / n)
+            phase.count(vertex_points=len(vertex_points))
 
         new_faces = []
-        new_vertices = set()
+        face_points = []
 
-        for face in self.faces:
-            fc = face.center.copy()
-            new_vertices.add(fc)
-            for v1, v2, v3 in zip(face.vertices, face.vertices[1:] + face.vertices[:1], face.vertices[2:] + face.vertices[:2]):
-                ec1 = (edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None))
-                ec2 = (edge_points.get((v2,v3), None) or edge_points.get((v3,v2), None))
-                v = vertex_points[v2]
-                new_faces.append(Face([ec1, v, ec2, fc]))
-
-        new_vertices.update(edge_points.values())
-        new_vertices.update(vertex_points.values())
-        
-        new_vertices = list(new_vertices)
+        with profiling.phase("CC.faces") as phase:
+            for face in self.faces:
+                fc = face.center.to_vertex(n_vertices + len(edge_points) + len(face_points))
+                face_points.append(fc)
+                for v1, v2, v3 in zip(face.vertices, face.vertices[1:] + face.vertices[:1], face.vertices[2:] + face.vertices[:2]):
+                    ec1 = (edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None))
+                    ec2 = (edge_points.get((v2,v3), None) or edge_points.get((v3,v2), None))
+                    v = vertex_points[v2]
+                    new_faces.append(Face([ec1, v, ec2, fc]))
+            phase.count(faces=len(new_faces))
 
-        for i, v in enumerate(new_vertices): v.id = i
+        new_vertices = list(vertex_points.values()) + list(edge_points.values()) + face_points
+        blocks = [(VERTEX, len(vertex_points)), (EDGE, len(edge_points)), (FACE, len(face_points))]
 
-        return Mesh(vertices=new_vertices, faces=new_faces)
+        return Mesh(vertices=new_vertices, faces=new_faces, blocks=blocks)
 
-    def subdivision_LOOP(self):
+    def subdivision_LOOP(self, workers=1):
+        if workers != 1: return self.subdivision_parallel("LOOP", workers)
 
         def alphas(n):
             if alphas.d.get(n, None): return alphas.d.get(n)
@@ -325,247 +375,212 @@ class Mesh:
 
         edge_points = {}
         vertex_points = {}
-
-        for face in self.faces:
-            for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
-                if (v1, v2) in edge_points.keys() or (v2, v1) in edge_points.keys(): continue
-                neighbour = face.get_neighbour(v1,v2) #or face.get_neighbour(v2,v1)
-                if neighbour:
-                    v = ((v1 + v2)*(1/8) + (face.center + neighbour.center)*(3/8))
-                    edge_points[(v1,v2)] = v  
-                else:
-                    v = (v1 + v2)/2
-                    edge_points[(v1,v2)] = v 
-
-        for v in self.vertices:
-            n = len(v.get_neighbours())
-            esc = sum([v1 for v1 in v.get_neighbours()], Vertex(0,0,0)) / n
-            vertex_points[v] = v*alphas(n) + esc * (1-alphas(n))
-            # print(n, "    ", esc, "    ", fsc, "    ", ((v * (n-3)) + (esc * 2) + fsc) / n)
+        n_vertices = len(self.vertices)
+
+        with profiling.phase("LOOP.edge_points") as phase:
+            for face in self.faces:
+                for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
+                    if (v1, v2) in edge_points.keys() or (v2, v1) in edge_points.keys(): continue
+                    neighbour = face.get_neighbour(v1,v2) #or face.get_neighbour(v2,v1)
+                    id = n_vertices + len(edge_points)
+                    if neighbour:
+                        v = ((v1 + v2)*(1/8) + (face.center + neighbour.center)*(3/8)).to_vertex(id)
+                        edge_points[(v1,v2)] = v  
+                    else:
+                        v = ((v1 + v2)/2).to_vertex(id)
+                        edge_points[(v1,v2)] = v 
+            phase.count(edge_points=len(edge_points))
+
+        with profiling.phase("LOOP.vertex_points") as phase:
+            for i, v in enumerate(self.vertices):
+                neighbours = v.get_neighbours()
+                n = len(neighbours)
+                esc = centroid(neighbours)
+                vertex_points[v] = (v*alphas(n) + esc * (1-alphas(n))).to_vertex(i)
+                # print(n, "    ", esc, "    ", fsc, "    ", ((v * (n-3)) + (esc * 2) + fsc) / n)
+            phase.count(vertex_points=len(vertex_points))
 
         new_faces = []
-        new_vertices = set()
 
-        for face in self.faces:
-            new_faces.append(Face([edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None) for v1,v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1])]))
-            for v1, v2, v3 in zip(face.vertices, face.vertices[1:] + face.vertices[:1], face.vertices[2:] + face.vertices[:2]):
-                ec1 = (edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None))
-                ec2 = (edge_points.get((v2,v3), None) or edge_points.get((v3,v2), None))
-                v = vertex_points[v2]
-                new_faces.append(Face([ec1, v, ec2]))
-
-        new_vertices.update(edge_points.values())
-        new_vertices.update(vertex_points.values())
-        
-        new_vertices = list(new_vertices)
+        with profiling.phase("LOOP.faces") as phase:
+            for face in self.faces:
+                new_faces.append(Face([edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None) for v1,v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1])]))
+                for v1, v2, v3 in zip(face.vertices, face.vertices[1:] + face.vertices[:1], face.vertices[2:] + face.vertices[:2]):
+                    ec1 = (edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None))
+                    ec2 = (edge_points.get((v2,v3), None) or edge_points.get((v3,v2), None))
+                    v = vertex_points[v2]
+                    new_faces.append(Face([ec1, v, ec2]))
+            phase.count(faces=len(new_faces))
 
-        for i, v in enumerate(new_vertices): v.id = i
+        new_vertices = list(vertex_points.values()) + list(edge_points.values())
+        blocks = [(VERTEX, len(vertex_points)), (EDGE, len(edge_points))]
 
-        return Mesh(vertices=new_vertices, faces=new_faces)
+        return Mesh(vertices=new_vertices, faces=new_faces, blocks=blocks)
 
-    def subdivision_PR(self):
+    def subdivision_PR(self, workers=1):
+        if workers != 1: return self.subdivision_parallel("PR", workers)
 
         edge_points = {}
         new_vertices = []
         new_faces = []
 
-        for face in self.faces:
-            for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
-                if (v1, v2) in edge_points.keys() or (v2, v1) in edge_points.keys(): continue
-                v = (v1 + v2)/2
-                edge_points[(v1,v2)] = v
-                new_vertices.append(v)
-
-        for face in self.faces:
-            new_faces.append(Face([edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None) for v1,v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1])]))
-        
-        for v in self.vertices:
-            if len(list(set(v.faces))) < 2: continue
-            v.repair_faces_order()
-            
-            # vvv
-            # in case faces around vertex are not consistent
-            # ^^^
-            first_face = v.faces[0]
-            last_face = v.faces[-1]
-            fi = first_face.vertices.index(v)
-            li = last_face.vertices.index(v)
-            f1,f2 = first_face.vertices[(fi - 1) % len(first_face.vertices)], first_face.vertices[(fi + 1) % len(first_face.vertices)]
-            l1,l2 = last_face.vertices[(li - 1) % len(last_face.vertices)], last_face.vertices[(li + 1) % len(last_face.vertices)]
-
-            tmp = []
-            vertices = set()
-            for face1, face2 in zip(v.faces, v.faces[1:] + v.faces[:1]):
-                sth = tuple(face1.get_edge(face2))
-                if len(sth) == 2:
-                    v1, v2 = face1.get_edge(face2)
-                    tmp.append(edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None))
-                    vertices.add(v1)
-                    vertices.add(v2)
-                else:
-                    pass
-                    # print(f"Warning: mesh is not consistent in around vertex {v}")
-
-            if f1 not in vertices:
-                tmp = [(edge_points.get((v,f1), None) or edge_points.get((f1,v), None))] + tmp
-            elif f2 not in vertices:
-                tmp = [(edge_points.get((v,f2), None) or edge_points.get((f2,v), None))] + tmp
-            if l1 not in vertices:
-                tmp.append(edge_points.get((v,l1), None) or edge_points.get((l1,v), None))
-            elif l2 not in vertices:
-                tmp.append(edge_points.get((v,l2), None) or edge_points.get((l2,v), None))
-
-            new_faces.append(Face(tmp))
-
-        for i, v in enumerate(new_vertices): v.id = i
-
-        return Mesh(vertices=new_vertices, faces=new_faces)
+        with profiling.phase("PR.edge_points") as phase:
+            for face in self.faces:
+                for v1, v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1]):
+                    if (v1, v2) in edge_points.keys() or (v2, v1) in edge_points.keys(): continue
+                    v = ((v1 + v2)/2).to_vertex(len(edge_points))
+                    edge_points[(v1,v2)] = v
+                    new_vertices.append(v)
+            phase.count(edge_points=len(edge_points))
+
+        with profiling.phase("PR.faces") as phase:
+            for face in self.faces:
+                new_faces.append(Face([edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None) for v1,v2 in zip(face.vertices, face.vertices[1:] + face.vertices[:1])]))
+            phase.count(faces=len(new_faces))
+
+        fan_vertices = [v for v in self.vertices if len(list(set(v.faces))) >= 2]
+        with profiling.phase("repair_faces_order") as phase:
+            for v in fan_vertices: v.repair_faces_order()
+            phase.count(vertices=len(fan_vertices))
+
+        with profiling.phase("PR.vertex_faces") as phase:
+            for v in fan_vertices:
+                # vvv
+                # in case faces around vertex are not consistent
+                # ^^^
+                first_face = v.faces[0]
+                last_face = v.faces[-1]
+                fi = first_face.vertices.index(v)
+                li = last_face.vertices.index(v)
+                f1,f2 = first_face.vertices[(fi - 1) % len(first_face.vertices)], first_face.vertices[(fi + 1) % len(first_face.vertices)]
+                l1,l2 = last_face.vertices[(li - 1) % len(last_face.vertices)], last_face.vertices[(li + 1) % len(last_face.vertices)]
+
+                tmp = []
+                vertices = set()
+                for face1, face2 in zip(v.faces, v.faces[1:] + v.faces[:1]):
+                    sth = tuple(face1.get_edge(face2))
+                    if len(sth) == 2:
+                        v1, v2 = face1.get_edge(face2)
+                        tmp.append(edge_points.get((v1,v2), None) or edge_points.get((v2,v1), None))
+                        vertices.add(v1)
+                        vertices.add(v2)
+                    else:
+                        pass
+                        # print(f"Warning: mesh is not consistent in around vertex {v}")
+
+                if f1 not in vertices:
+                    tmp = [(edge_points.get((v,f1), None) or edge_points.get((f1,v), None))] + tmp
+                elif f2 not in vertices:
+                    tmp = [(edge_points.get((v,f2), None) or edge_points.get((f2,v), None))] + tmp
+                if l1 not in vertices:
+                    tmp.append(edge_points.get((v,l1), None) or edge_points.get((l1,v), None))
+                elif l2 not in vertices:
+                    tmp.append(edge_points.get((v,l2), None) or edge_points.get((l2,v), None))
+
+                new_faces.append(Face(tmp))
+            phase.count(faces=len(fan_vertices))
+
+        return Mesh(vertices=new_vertices, faces=new_faces, blocks=[(EDGE, len(new_vertices))])
 
 
     def subdivision_mixed(self):
         return self.subdivision_CC() if random.randint(0,1) == 0 else self.subdivision_DS()
 
 
-def choose_subdivision_algorithm(string_name):
-    if string_name == "CathmulClark": return lambda m: m.subdivision_CC()
-    if string_name == "DooSabin": return lambda m: m.subdivision_DS()
-    if string_name == "Loop": return lambda m: m.subdivision_LOOP()
-    return lambda m: m.subdivision_CC()
+def choose_subdivision_code(string_name):
+    if string_name in ("CC", "DS", "LOOP", "PR"): return string_name
+    if string_name == "CathmulClark": return "CC"
+    if string_name == "DooSabin": return "DS"
+    if string_name == "Loop": return "LOOP"
+    if string_name == "PetersReif": return "PR"
+    return "CC"
 
-def subdivision(filename_input, filename_output, iterations_count, algorithm_name):
+def choose_subdivision_algorithm(string_name):
+    code = choose_subdivision_code(string_name)
+    return lambda m: getattr(m, "subdivision_" + code)()
+
+def subdivision(filename_input, filename_output, iterations_count, algorithm_name, out_of_core=False, workers=1, threshold=None, profiler=None, cache=None, progress=None, repair=False, dtype=float, decimals=None):
+    """repair: fix the topology of the input first and warn about what can't be fixed (see validate.py).
+    threshold: refine only faces with dihedral angles above threshold degrees (CathmulClark and Loop only).
+    profiler: profiling.Profiler recording the phases of the run (reading, every level, saving).
+    cache: cache.Cache reusing (and storing) the levels of earlier runs on the same mesh.
+    progress: progress(level, iterations_count) is called after every level.
+    dtype: of the positions (np.float32 for previews: half the memory), decimals: fixed decimals of the written coordinates."""
+    if profiler is not None:
+        with profiler:
+            return subdivision(filename_input, filename_output, iterations_count, algorithm_name, out_of_core, workers, threshold, cache=cache, progress=progress, repair=repair, dtype=dtype, decimals=decimals)
+
+    from compact import CompactMesh
+    if out_of_core:
+        # the store runs level by level in this process, in float64
+        unsupported = [name for name, used in [("workers", workers != 1), ("threshold", threshold is not None), ("cache", cache is not None),
+                                               ("dtype", np.dtype(dtype) != np.float64)] if used]
+        if unsupported: raise Exception(f"out_of_core subdivision doesn't support {', '.join(unsupported)}")
+        return subdivision_out_of_core(filename_input, filename_output, iterations_count, algorithm_name, progress, decimals, repair)
+    with profiling.phase("read") as phase:
+        mesh = CompactMesh.from_file(filename_input, dtype=dtype)
+        phase.count(vertices=mesh.vertex_count, faces=mesh.face_count)
+    if repair:
+        import validate
+        with profiling.phase("repair"):
+            mesh, report = validate.repair(mesh)
+        if report.remaining: warnings.warn(f"{filename_input}:\n{report}")
+    code = choose_subdivision_code(algorithm_name)
+    if cache is not None:
+        options = {} if threshold is None else {"threshold": threshold}
+        if mesh.positions.dtype != float: options["dtype"] = mesh.positions.dtype.name
+        if threshold is not None: step = lambda m: m.subdivision_adaptive(code, threshold)
+        else: step = lambda m: getattr(m, "subdivision_" + code)(workers)
+        return cache.subdivision(mesh, code, iterations_count, step, progress, **options).save(filename_output, decimals=decimals)
+    if workers != 1:
+        import parallel
+        return parallel.subdivision(mesh, code, iterations_count, workers, progress).save(filename_output, decimals=decimals)
     subdivision_algorithm = choose_subdivision_algorithm(algorithm_name)
-    mesh = Mesh(filename = filename_input)
+    if threshold is not None:
+        subdivision_algorithm = lambda m: m.subdivision_adaptive(code, threshold)
+    if code == "PR" and threshold is None:
+        import peters_reif
+        # levels carry their half-edges to the next one, the last one doesn't need them
+        levels = iter(range(iterations_count, 0, -1))
+        subdivision_algorithm = lambda m: peters_reif.subdivide(m, carry=next(levels) > 1)
     for i in range(iterations_count):
-        mesh = subdivision_algorithm(mesh)
-    mesh.save(filename_output)
-        
-
-if __name__ == "__main__":
-
-    # mesh = Mesh(filename = "cube.off")
-
-    # total_time = 0
-    # for i in range(8):
-    #     mesh.save(f"meshes/mesh_subdivided_{i}_times.off")
-
-    #     if total_time < 0.001:
-    #         time_str = str(round(total_time * 1000, 5)) + " ms"
-    #     elif total_time < 0.1:
-    #         time_str = str(round(total_time * 1000, 2)) + " ms"
-    #     else: time_str = str(round(total_time, 2)) + " s"
-    #     print(f'| mesh after {i} subdivision_DSs<br />vertices: {len(mesh.vertices)}<br />faces: {len(mesh.faces)}<br />time to compute: {time_str} | <img src="photos/photo00_L0{i}.png" alt="drawing" width="50%"/> |')
-        
-    #     if i == 7 : break
-    #     t1 = time.time()
-    #     mesh = mesh.subdivision_DS()
-    #     t2 = time.time()
-    #     total_time += t2-t1
-
-    
-    # mesh = Mesh(filename="best_meshes/suzanne.off")
-    # for i in range(3):
-    #     mesh = mesh.subdivision_LOOP()
-    #     mesh.save(f"suzanne_smooth_{i+1}.off")
-
-    mesh_DS = Mesh(filename = "suzanne.off")
-    mesh_CC = Mesh(filename = "suzanne.off")
-    mesh_LOOP = Mesh(filename = "suzanne.off", triangular=True)
-    mesh_PR = Mesh(filename = "suzanne.off")
-
-    DS_list = []
-    CC_list = []
-    LOOP_list = []
-    PR_list = []
-
-    n = 6
-
-    print("\n\n\nDS")
-    total_time = 0
-    for i in range(n):
-        mesh_DS.save(f"cube_DS{i}.off")
-
-        if total_time < 0.001:
-            time_str = str(round(total_time * 1000, 5)) + " ms"
-        elif total_time < 0.1:
-            time_str = str(round(total_time * 1000, 2)) + " ms"
-        else: time_str = str(round(total_time, 2)) + " s"
-        DS_list.append(f'![img](photos/group_photo00_L{(str(i+n) if i+n>=10 else "0"+str(i+n))}.png) <br/> {len(mesh_DS.vertices)} \| {len(mesh_DS.faces)} \| {time_str}')
-        print(f"{len(mesh_DS.vertices)}\t{len(mesh_DS.faces)}\t{time_str}")
-        
-        if i == n-1 : break
-        t1 = time.time()
-        mesh_DS = mesh_DS.subdivision_DS()
-        t2 = time.time()
-        total_time += t2-t1
-
-    print("\n\n\nCC")
-    total_time = 0
-    for i in range(n):
-        mesh_CC.save(f"cube_CC{i}.off")
-
-        if total_time < 0.001:
-            time_str = str(round(total_time * 1000, 5)) + " ms"
-        elif total_time < 0.1:
-            time_str = str(round(total_time * 1000, 2)) + " ms"
-        else: time_str = str(round(total_time, 2)) + " s"
-        CC_list.append(f'![img](photos/group_photo00_L{(str(i) if i>=10 else "0"+str(i))}.png) <br/> {len(mesh_CC.vertices)} \| {len(mesh_CC.faces)} \| {time_str}')
-        print(f"{len(mesh_CC.vertices)}\t{len(mesh_CC.faces)}\t{time_str}")
-
-        if i == n-1 : break
-        t1 = time.time()
-        mesh_CC = mesh_CC.subdivision_CC()
-        t2 = time.time()
-        total_time += t2-t1
-
-    total_time = 0
-    print("\n\n\nLOOP")
-    for i in range(n):
-        mesh_LOOP.save(f"cube_LOOP{i}.off")
-
-        if total_time < 0.001:
-            time_str = str(round(total_time * 1000, 5)) + " ms"
-        elif total_time < 0.1:
-            time_str = str(round(total_time * 1000, 2)) + " ms"
-        else: time_str = str(round(total_time, 2)) + " s"
-        LOOP_list.append(f'![img](photos/group_photo00_L{(str(i+n+n) if i+n+n>=10 else "0"+str(i+n+n))}.png) <br/> {len(mesh_LOOP.vertices)} \| {len(mesh_LOOP.faces)} \| {time_str}')
-        print(f"{len(mesh_LOOP.vertices)}\t{len(mesh_LOOP.faces)}\t{time_str}")
-
-        if i == n-1 : break
-        t1 = time.time()
-        mesh_LOOP = mesh_LOOP.subdivision_LOOP()
-        t2 = time.time()
-        total_time += t2-t1
-
-    
-    total_time = 0
-    print("\n\n\nPR")
-    for i in range(2*n-1):
-        mesh_PR.save(f"cube_PR{i}.off")
-
-        if total_time < 0.001:
-            time_str = str(round(total_time * 1000, 5)) + " ms"
-        elif total_time < 0.1:
-            time_str = str(round(total_time * 1000, 2)) + " ms"
-        else: time_str = str(round(total_time, 2)) + " s"
-        PR_list.append(f'![img](photos/group_photo00_L{(str(i+n+n+n) if i+n+n+n>=10 else "0"+str(i+n+n+n))}.png) <br/> {len(mesh_PR.vertices)} \| {len(mesh_PR.faces)} \| {time_str}')
-        print(f"{len(mesh_PR.vertices)}\t{len(mesh_PR.faces)}\t{time_str}")
-        if i == 2*n-2 : break
-        t1 = time.time()
-        mesh_PR = mesh_PR.subdivision_PR()
-        t2 = time.time()
-        total_time += t2-t1
-
-    DS_list += [" "]*(n-1)
-    CC_list += [" "]*(n-1)
-    LOOP_list += [" "]*(n-1)
-    for e1, e2, e3, e4 in zip(DS_list, CC_list, LOOP_list, PR_list):
-        print("|",e1,"|",e2,"|",e3,"|", e4, "|")
-
-    # mesh = Mesh(filename="suzanne.off")
-    # mesh = mesh.subdivision_PR()
-    # mesh.save("suzanne2.off")
-    # mesh = mesh.subdivision_PR()
-    # mesh.save("suzanne3.off")
-    
-
-
+        with profiling.phase(f"level {i + 1}") as phase:
+            mesh = subdivision_algorithm(mesh)
+            phase.count(vertices=mesh.vertex_count, faces=mesh.face_count)
+        if progress: progress(i + 1, iterations_count)
+    with profiling.phase("save"):
+        mesh.save(filename_output, decimals=decimals)
+
+def subdivision_out_of_core(filename_input, filename_output, iterations_count, algorithm_name, progress=None, decimals=None, repair=False):
+    """Like subdivision(), but every level lives in a memory-mapped store.MeshStore next to the output
+    (filename_output without extension keeps the last level as a store directory)."""
+    import os
+    import shutil
+    import tempfile
+    from compact import CompactMesh
+    from store import MeshStore
+
+    code = choose_subdivision_code(algorithm_name)
+    output_directory = os.path.dirname(os.path.abspath(filename_output))
+    with tempfile.TemporaryDirectory(dir=output_directory) as scratch:
+        mesh = CompactMesh.from_file(filename_input)
+        # the store has no crease rules (the other schemes ignore creases anyway)
+        if code == "CC" and mesh.creases is not None: raise Exception("out_of_core subdivision doesn't support creases")
+        if repair:
+            import validate
+            mesh, report = validate.repair(mesh)
+            if report.remaining: warnings.warn(f"{filename_input}:\n{report}")
+        store = MeshStore.from_mesh(os.path.join(scratch, "level0"), mesh)
+        del mesh
+        for i in range(iterations_count):
+            previous = store
+            store = store.subdivision(code, os.path.join(scratch, f"level{i + 1}"))
+            del previous
+            shutil.rmtree(os.path.join(scratch, f"level{i}"))
+            if progress: progress(i + 1, iterations_count)
+
+        if os.path.splitext(filename_output)[1]:
+            store.save(filename_output, decimals=decimals)
+        else:
+            del store
+            shutil.move(os.path.join(scratch, f"level{iterations_count}"), filename_output)
@@ -0,0 +1,272 @@
+"""Fast mesh file reading and writing.
+
+Text .off files are read in fixed-size blocks and every block of vertex/face
+lines is parsed at once with NumPy, so the whole text is never held in memory
+and big scans load in seconds. Writing formats whole blocks of lines at once.
+For cheap checkpoints there are also binary .off ("OFF BINARY", float32) and
+.npz (positions, face_indices, face_offsets arrays) files. Positions can be read
+as float32 (dtype) and written with a fixed number of decimals, which halves
+the memory and the size of big preview levels. Crease weights of
+edges live next to the mesh in a .creases file ("v1 v2 sharpness" lines).
+
+How to use it?
+> positions, face_indices, face_offsets = read_mesh("cube.off")
+> write_mesh("cube.npz", positions, face_indices, face_offsets)
+> write_mesh("cube_binary.off", positions, face_indices, face_offsets, binary=True)
+> positions, face_indices, face_offsets = read_mesh("scan.off", dtype=np.float32)
+> write_mesh("scan_preview.off", positions, face_indices, face_offsets, decimals=4)
+> pairs, weights = read_creases("example_crease.off")  # from example_crease.creases
+"""
+
+import os
+import re
+import warnings
+
+import numpy as np
+
+block_size = 1 << 22
+rows_per_write = 1 << 16
+
+header_pattern = re.compile(r"^\s*(OFF)?\s*(\d+(\s+\d+){2,3})\s*$")
+blank_line_pattern = re.compile(r"\n[ \t\r]*\n")
+
+
+def data_lines(file):
+    """Lines of the file in lists, block after block, without blank lines and comments."""
+    rest = ""
+    while True:
+        block = file.read(block_size)
+        if not block: break
+        block = rest + block
+        cut = block.rfind("\n") + 1
+        rest = block[cut:]
+        text = block[:cut]
+        lines = text.splitlines()
+        if "#" in text or blank_line_pattern.search("\n" + text):
+            lines = [line for line in lines if line.strip() and not line.lstrip().startswith("#")]
+        yield lines
+    if rest.strip(): yield [rest]
+
+
+class LineReader:
+    def __init__(self, file):
+        self.blocks = data_lines(file)
+        self.block = []
+        self.position = 0
+
+    def take(self, count):
+        """Next count lines, in chunks of at most one block."""
+        while count > 0:
+            # (blocks of only comments or blank lines, or inside a line longer than a block, have no lines)
+            while self.position == len(self.block):
+                self.block = next(self.blocks, None)
+                self.position = 0
+                if self.block is None: raise Exception("unexpected end of .off file")
+            chunk = self.block[self.position:self.position + count]
+            self.position += len(chunk)
+            count -= len(chunk)
+            yield chunk
+
+
+def parse_vertices(lines):
+    try:
+        return np.loadtxt(lines, usecols=(0, 1, 2), ndmin=2)
+    except ValueError:
+        return np.array([[float(num) for num in line.split()[:3]] for line in lines])
+
+
+def parse_faces(lines):
+    # -1 between lines marks where every face starts (vertex indices are never negative)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            tokens = np.fromstring(" -1 ".join(lines), dtype=np.int64, sep=" ")
+        starts = np.concatenate([[0], np.flatnonzero(tokens == -1) + 1])
+        if len(starts) != len(lines): raise ValueError
+    except (ValueError, DeprecationWarning):
+        faces = [[int(num) for num in line.split()] for line in lines]
+        faces = [face[1:1 + face[0]] for face in faces]
+        return np.array([len(face) for face in faces], dtype=np.int64), np.array([v for face in faces for v in face], dtype=np.int64)
+
+    sizes = tokens[starts]
+    corners = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return sizes, tokens[np.repeat(starts + 1, sizes) + corners]
+
+
+def triangulate(face_indices, face_offsets):
+    """Fan triangulation (first vertex with every next pair) of the faces with more than 3 vertices."""
+    sizes = np.diff(face_offsets)
+    counts = np.where(sizes == 3, 1, np.maximum(sizes - 2, 0))
+    face = np.repeat(np.arange(len(sizes)), counts)
+    start = face_offsets[:-1][face]
+    step = np.arange(len(face)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    triangles = np.stack([face_indices[start], face_indices[start + step], face_indices[start + step + 1]], axis=1)
+    return triangles.ravel(), np.arange(0, triangles.size + 1, 3)
+
+
+def read_binary_off(file, dtype=float):
+    vertices_count, faces_count, _ = np.frombuffer(file.read(12), dtype=">i4")
+    positions = np.frombuffer(file.read(12 * vertices_count), dtype=">f4").reshape(-1, 3).astype(dtype)
+    data = np.frombuffer(file.read(), dtype=">i4")
+
+    # every face is [k, k indices, colors count, colors]
+    size = int(data[0]) if len(data) else 0
+    table = data.reshape(-1, size + 2) if len(data) == faces_count * (size + 2) else data[:0].reshape(0, size + 2)
+    if len(table) == faces_count and np.all(table[:, 0] == size) and np.all(table[:, -1] == 0):
+        face_indices = table[:, 1:-1].ravel()
+        sizes = table[:, 0]
+    else:
+        data = data.tolist()
+        sizes, starts, position = [], [], 0
+        for i in range(faces_count):
+            sizes.append(data[position])
+            starts.append(position + 1)
+            position += data[position] + 2 + data[position + data[position] + 1]
+        sizes, starts = np.array(sizes, dtype=np.int64), np.array(starts, dtype=np.int64)
+        corners = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        face_indices = np.array(data)[np.repeat(starts, sizes) + corners]
+
+    return positions, face_indices.astype(np.int64), np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+
+
+def read_off(filename, triangular=False, dtype=float):
+    """(positions, face_indices, face_offsets) of an .off file, as written in the file (no cleanup);
+    dtype: of the positions (float32 is parsed block by block into half the memory)."""
+    if filename.split(".")[-1] != "off": raise Exception("mesh support only .off files")
+
+    with open(filename, "rb") as f:
+        if f.readline().split()[:2] == [b"OFF", b"BINARY"]:
+            positions, face_indices, face_offsets = read_binary_off(f, dtype)
+            if triangular and np.any(np.diff(face_offsets) != 3):
+                face_indices, face_offsets = triangulate(face_indices, face_offsets)
+            return positions, face_indices, face_offsets
+
+    with open(filename) as f:
+        reader = LineReader(f)
+        while True:
+            line = next(reader.take(1))[0]
+            match = header_pattern.search(line)
+            if match:
+                nums = [int(num) for num in match.group(2).split()]
+                vertices_count = nums[0]
+                faces_count = nums[-2]
+                edges_count = nums[1] if len(nums) > 3 else 0
+                break
+
+        positions = np.empty((vertices_count, 3), dtype=dtype)
+        done = 0
+        for chunk in reader.take(vertices_count):
+            positions[done:done + len(chunk)] = parse_vertices(chunk)
+            done += len(chunk)
+
+        for chunk in reader.take(edges_count): pass
+
+        sizes, indices = [], []
+        for chunk in reader.take(faces_count):
+            chunk_sizes, chunk_indices = parse_faces(chunk)
+            sizes.append(chunk_sizes)
+            indices.append(chunk_indices)
+
+    face_indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+    face_offsets = np.concatenate([[0], np.cumsum(np.concatenate(sizes) if sizes else [], dtype=np.int64)])
+    if triangular and np.any(np.diff(face_offsets) != 3):
+        face_indices, face_offsets = triangulate(face_indices, face_offsets)
+    return positions, face_indices, face_offsets
+
+
+def read_npz(filename, triangular=False, dtype=float):
+    with np.load(filename) as data:
+        positions, face_indices, face_offsets = data["positions"].astype(dtype, copy=False), data["face_indices"], data["face_offsets"]
+    if triangular and np.any(np.diff(face_offsets) != 3):
+        face_indices, face_offsets = triangulate(face_indices, face_offsets)
+    return positions, face_indices, face_offsets
+
+
+def read_mesh(filename, triangular=False, dtype=float):
+    extension = filename.split(".")[-1]
+    if extension == "off": return read_off(filename, triangular, dtype)
+    if extension == "npz": return read_npz(filename, triangular, dtype)
+    raise Exception("mesh support only .off and .npz files")
+
+
+def vertex_format(positions, decimals=None):
+    """Format of a coordinate: decimals fixed decimals, or the shortest repr (9 digits are enough for float32)."""
+    if decimals is not None: return f"%.{int(decimals)}f"
+    return "%.9g" if positions.dtype == np.float32 else "%r"
+
+
+def format_vertices(positions, decimals=None):
+    number = vertex_format(positions, decimals)
+    return (f"{number} {number} {number}\n" * len(positions)) % tuple(positions.ravel().tolist())
+
+
+def format_faces(face_indices, face_offsets):
+    sizes = np.diff(face_offsets)
+    if len(sizes) and np.all(sizes == sizes[0]):
+        table = np.column_stack([sizes, face_indices.reshape(len(sizes), -1)])
+        return (("%d " * int(sizes[0]) + "%d\n") * len(sizes)) % tuple(table.ravel().tolist())
+
+    # [k, indices...] of every face, " " after every number but the last one of a line
+    tokens = np.insert(face_indices, face_offsets[:-1], sizes)
+    values = np.full(2 * len(tokens), " ", dtype=object)
+    values[0::2] = tokens.tolist()
+    values[2 * (face_offsets[1:] + np.arange(len(sizes))) + 1] = "\n"
+    return ("%d%s" * len(tokens)) % tuple(values)
+
+
+def write_off(filename, positions, face_indices, face_offsets, decimals=None):
+    with open(filename, "w") as f:
+        f.write(f"OFF\n{len(positions)} {len(face_offsets) - 1} 0\n")
+        for start in range(0, len(positions), rows_per_write):
+            f.write(format_vertices(positions[start:start + rows_per_write], decimals))
+        for start in range(0, len(face_offsets) - 1, rows_per_write):
+            offsets = face_offsets[start:start + rows_per_write + 1]
+            f.write(format_faces(face_indices[offsets[0]:offsets[-1]], offsets - offsets[0]))
+
+
+def write_binary_off(filename, positions, face_indices, face_offsets):
+    sizes = np.diff(face_offsets)
+    faces = np.zeros(len(face_indices) + 2 * len(sizes), dtype=">i4")
+    starts = face_offsets[:-1] + 2 * np.arange(len(sizes))
+    faces[starts] = sizes
+    faces[np.repeat(starts + 1 - face_offsets[:-1], sizes) + np.arange(len(face_indices))] = face_indices
+    with open(filename, "wb") as f:
+        f.write(b"OFF BINARY\n")
+        f.write(np.array([len(positions), len(sizes), 0], dtype=">i4").tobytes())
+        f.write(np.asarray(positions, dtype=">f4").tobytes())
+        f.write(faces.tobytes())
+
+
+def write_npz(filename, positions, face_indices, face_offsets):
+    with open(filename, "wb") as f:
+        np.savez(f, positions=positions, face_indices=face_indices, face_offsets=face_offsets)
+
+
+def write_mesh(filename, positions, face_indices, face_offsets, binary=False, decimals=None):
+    """decimals: fixed number of decimals of the coordinates of text .off files (all digits by default)."""
+    extension = filename.split(".")[-1]
+    if extension == "npz": return write_npz(filename, positions, face_indices, face_offsets)
+    if extension != "off": raise Exception("mesh support only .off and .npz files")
+    if binary: return write_binary_off(filename, positions, face_indices, face_offsets)
+    return write_off(filename, positions, face_indices, face_offsets, decimals)
+
+
+def creases_filename(filename):
+    return os.path.splitext(filename)[0] + ".creases"
+
+
+def read_creases(filename):
+    """(pairs, weights) from the .creases file of the mesh filename, None if there is none."""
+    path = creases_filename(filename)
+    if not os.path.exists(path): return None
+    with warnings.catch_warnings():
+        # an empty file
+        warnings.simplefilter("ignore", UserWarning)
+        table = np.loadtxt(path, comments="#", ndmin=2).reshape(-1, 3)
+    return table[:, :2].astype(np.int64), table[:, 2].astype(float)
+
+
+def write_creases(filename, pairs, weights):
+    """.creases file of the mesh filename."""
+    with open(creases_filename(filename), "w") as f:
+        f.write("".join(f"{a} {b} {w!r}\n" for (a, b), w in zip(np.asarray(pairs).tolist(), np.asarray(weights).tolist())))
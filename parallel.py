@@ -0,0 +1,194 @@
+"""Multiprocess subdivision of big meshes.
+
+The faces are split into spatially coherent patches (runs of faces in Morton
+order of their centers). Every worker process subdivides one patch together with
+its halo, the faces around the vertices of the patch, so all neighbours of the
+patch are there, and keeps only the new vertices and faces that come from the
+elements its patch owns: the faces of the patch, the edges whose first half-edge
+lies in the patch and the vertices whose first face does. The input arrays are
+shared with the workers through shared memory. Every piece is numbered by the
+elements of the whole mesh it comes from (Stencil blocks and face keys), so the
+result is exactly the one of the serial CompactMesh.subdivision_*.
+
+How to use it?
+> mesh = CompactMesh.from_file("scan.off")
+> mesh2 = subdivision(mesh, "CC", 2, workers=8)
+or
+> mesh2 = mesh.subdivision_CC(workers=8)
+"""
+
+import concurrent.futures
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import profiling
+from compact import CompactMesh, VERTEX, EDGE, FACE, CORNER, gather_faces
+
+patches_per_worker = 4
+min_patch_faces = 1 << 12
+
+
+def morton_codes(points):
+    """Morton (Z-order) codes of 3D points, 21 bits per axis."""
+    low, high = points.min(axis=0), points.max(axis=0)
+    cells = ((points - low) / np.maximum(high - low, 1e-300) * ((1 << 21) - 1)).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for axis in range(3):
+        x = cells[:, axis]
+        x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+        x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+        x = (x | (x << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+        x = (x | (x << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+        x = (x | (x << np.uint64(2))) & np.uint64(0x1249249249249249)
+        codes |= x << np.uint64(axis)
+    return codes
+
+
+def split_faces(mesh, patches_count):
+    """Patch number of every face: patches_count runs of faces in Morton order."""
+    order = np.argsort(morton_codes(mesh.face_centers()), kind="stable")
+    patch = np.empty(mesh.face_count, dtype=np.int64)
+    patch[order] = np.arange(mesh.face_count) * patches_count // max(mesh.face_count, 1)
+    return patch
+
+
+class SharedArrays:
+    """NumPy arrays in shared memory blocks, passed to workers as (name, shape, dtype) specs."""
+
+    def __init__(self, arrays):
+        self.blocks = []
+        self.specs = {}
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def attach(specs):
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, (block_name, _, _) in specs.items()}
+    arrays = {name: np.ndarray(shape, dtype, buffer=blocks[name].buf) for name, (_, shape, dtype) in specs.items()}
+    return blocks, arrays
+
+
+def patch_pieces(shared, algorithm, p):
+    """New vertices and faces of the elements owned by patch p, numbered by the elements of the whole mesh."""
+    face_indices, face_offsets = shared["face_indices"], shared["face_offsets"]
+    patch, vertex_owner = shared["patch"], shared["vertex_owner"]
+    face_count = len(face_offsets) - 1
+
+    # the patch and its halo: all faces around the vertices of the patch
+    patch_indices, _ = gather_faces(face_indices, face_offsets, np.flatnonzero(patch == p))
+    ring_faces, _ = gather_faces(shared["vertex_faces"], shared["vertex_offsets"], np.unique(patch_indices))
+    faces = np.unique(ring_faces)
+    indices, offsets = gather_faces(face_indices, face_offsets, faces)
+    vertices, local_indices = np.unique(indices, return_inverse=True)
+    mesh = CompactMesh(shared["positions"][vertices], local_indices.reshape(-1), offsets)
+    corners = np.arange(len(indices)) + np.repeat(face_offsets[faces] - offsets[:-1], mesh.face_sizes)
+
+    stencil = getattr(mesh, "stencil_" + algorithm)()
+    matrix = stencil.matrix if mesh.positions.dtype == float else stencil.matrix.astype(mesh.positions.dtype)
+    points = matrix @ mesh.positions
+    he = mesh.halfedges
+
+    # owner and element of the whole mesh for every local element kind
+    primary = he.edge_halfedge
+    elements = {VERTEX: vertices, EDGE: corners[primary], FACE: faces, CORNER: corners}
+    owned = {VERTEX: vertex_owner[vertices] == p, EDGE: patch[faces[he.face[primary]]] == p,
+             FACE: patch[faces] == p, CORNER: patch[faces[he.face]] == p}
+    kinds = np.concatenate([np.full(count, kind) for kind, count in stencil.blocks])
+    element = np.concatenate([elements[kind] for kind, _ in stencil.blocks])
+    keep = np.concatenate([owned[kind] for kind, _ in stencil.blocks])
+
+    # faces around a vertex belong to the owner of the vertex, all others to the owner of their face
+    major, minor = stencil.face_major, stencil.face_minor
+    around_vertex = major >= mesh.face_count
+    major = np.where(around_vertex, face_count + vertices[np.maximum(major - mesh.face_count, 0)], faces[np.minimum(major, mesh.face_count - 1)])
+    keep_faces = np.flatnonzero(np.where(around_vertex, vertex_owner[np.maximum(major - face_count, 0)], patch[np.minimum(major, face_count - 1)]) == p)
+    refs, ref_offsets = gather_faces(stencil.face_indices, stencil.face_offsets, keep_faces)
+
+    return {
+        "blocks": [kind for kind, _ in stencil.blocks],
+        "kinds": kinds[keep], "elements": element[keep], "points": points[keep],
+        "major": major[keep_faces], "minor": np.where(minor >= 0, corners[np.maximum(minor, 0)], -1)[keep_faces],
+        "ref_kinds": kinds[refs], "ref_elements": element[refs], "sizes": np.diff(ref_offsets),
+    }
+
+
+def subdivide_patch(specs, algorithm, p):
+    blocks, shared = attach(specs)
+    try:
+        return patch_pieces(shared, algorithm, p)
+    finally:
+        del shared
+        for block in blocks.values(): block.close()
+
+
+def stitch(mesh, pieces):
+    """CompactMesh of the next level from the pieces of all patches."""
+    edges = np.zeros(len(mesh.face_indices), dtype=bool)
+    for piece in pieces: edges[piece["elements"][piece["kinds"] == EDGE]] = True
+    edge_number = np.cumsum(edges) - 1
+    counts = {VERTEX: mesh.vertex_count, EDGE: int(np.count_nonzero(edges)), FACE: mesh.face_count, CORNER: len(mesh.face_indices)}
+
+    offsets, offset = {}, 0
+    for kind in pieces[0]["blocks"]:
+        offsets[kind] = offset
+        offset += counts[kind]
+    table = np.array([offsets.get(kind, 0) for kind in range(4)])
+
+    def numbers(kinds, elements):
+        return table[kinds] + np.where(kinds == EDGE, edge_number[elements], elements)
+
+    positions = np.empty((offset, 3), dtype=mesh.positions.dtype)
+    for piece in pieces: positions[numbers(piece["kinds"], piece["elements"])] = piece["points"]
+
+    major = np.concatenate([piece["major"] for piece in pieces])
+    minor = np.concatenate([piece["minor"] for piece in pieces])
+    indices = np.concatenate([numbers(piece["ref_kinds"], piece["ref_elements"]) for piece in pieces])
+    face_offsets = np.concatenate([[0], np.cumsum(np.concatenate([piece["sizes"] for piece in pieces]))])
+    return CompactMesh(positions, *gather_faces(indices, face_offsets, np.lexsort((minor, major))))
+
+
+def subdivide(mesh, algorithm, executor, patches_count):
+    """One level of mesh, patch by patch in the executor's worker processes."""
+    patch = split_faces(mesh, patches_count)
+    he_face = np.repeat(np.arange(mesh.face_count), mesh.face_sizes)
+    by_vertex = np.argsort(mesh.face_indices, kind="stable")
+    vertex_faces = he_face[by_vertex]
+    vertex_offsets = np.concatenate([[0], np.cumsum(np.bincount(mesh.face_indices, minlength=mesh.vertex_count))])
+    vertex_owner = patch[vertex_faces[vertex_offsets[:-1]]]
+
+    shared = SharedArrays({"positions": mesh.positions, "face_indices": mesh.face_indices, "face_offsets": mesh.face_offsets,
+                           "vertex_faces": vertex_faces, "vertex_offsets": vertex_offsets, "patch": patch, "vertex_owner": vertex_owner})
+    try:
+        with profiling.phase("patches") as phase:
+            pieces = list(executor.map(subdivide_patch, [shared.specs] * patches_count, [algorithm] * patches_count, range(patches_count)))
+            phase.count(patches=patches_count)
+    finally:
+        shared.close()
+    with profiling.phase("stitch"):
+        return stitch(mesh, pieces)
+
+
+def subdivision(mesh, algorithm, iterations_count=1, workers=None, progress=None):
+    """iterations_count levels of the scheme (CC, DS, LOOP or PR) using workers processes (all cores for None);
+    progress(level, iterations_count) is called after every level."""
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for i in range(iterations_count):
+            patches_count = min(workers * patches_per_worker, mesh.face_count // min_patch_faces)
+            # (every vertex needs a face to have an owner, the patches don't carry creases)
+            if patches_count < 2 or mesh.creases is not None or np.any(np.bincount(mesh.face_indices, minlength=mesh.vertex_count) == 0):
+                mesh = mesh.subdivide(algorithm)
+            else:
+                mesh = subdivide(mesh, algorithm, executor, patches_count)
+            if progress: progress(i + 1, iterations_count)
+    return mesh
@@ -0,0 +1,132 @@
+"""Opt-in profiling of the subdivision passes.
+
+The subdivision code marks its phases (edge points, vertex points, face
+construction, repair_faces_order, Mesh cleanup, stencils, ...) with
+profiling.phase(name). Without an active Profiler a phase is one shared no-op
+context manager, so the instrumentation costs nothing. Inside `with Profiler()`
+every phase records its wall time, the element counts reported by the code, the
+change of allocated memory blocks and the garbage collections during the phase.
+Finished phases go to the optional callback, can be summed up per name and
+exported in the Chrome trace-event format (chrome://tracing, Perfetto).
+
+How to use it?
+> with Profiler() as profiler:
+>     mesh2 = mesh.subdivision_CC()
+> print(profiler.report())
+> profiler.save_chrome_trace("cc.json")
+or
+> subdivision("cube.off", "cube_smooth.off", 3, "CathmulClark", profiler=Profiler(callback=print))
+"""
+
+import gc
+import json
+import os
+import sys
+import threading
+import time
+
+active = None
+
+
+class Disabled:
+    """Phase used when no Profiler is active."""
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): return False
+
+    def count(self, **counts): pass
+
+disabled = Disabled()
+
+
+def phase(name):
+    """Context manager timing the phase name in the active Profiler (a no-op without one)."""
+    return disabled if active is None else active.phase(name)
+
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.counts = {}
+
+    def count(self, **counts):
+        """Add element counts (e.g. faces=len(faces)) to the phase."""
+        for key, value in counts.items(): self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        self.depth = len(self.profiler.stack)
+        self.profiler.stack.append(self)
+        self.collections = sum(stats["collections"] for stats in gc.get_stats())
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler.stack.pop()
+        self.profiler.finish({
+            "name": self.name, "start": self.start - self.profiler.start, "seconds": end - self.start, "depth": self.depth,
+            "counts": self.counts, "allocated_blocks": sys.getallocatedblocks() - self.blocks,
+            "gc_collections": sum(stats["collections"] for stats in gc.get_stats()) - self.collections,
+        })
+        return False
+
+
+class Profiler:
+    """Records the phases run while it is active (`with profiler:`); callback gets every finished phase as a dict."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.events = []
+        self.stack = []
+        self.start = time.perf_counter()
+        self.previous = []
+
+    def __enter__(self):
+        global active
+        self.previous.append(active)
+        active = self
+        return self
+
+    def __exit__(self, *exc):
+        global active
+        active = self.previous.pop()
+        return False
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def finish(self, event):
+        self.events.append(event)
+        if self.callback: self.callback(event)
+
+    def summary(self):
+        """{name: {"calls", "seconds", "allocated_blocks", "gc_collections", counts...}} summed over all phases with this name."""
+        result = {}
+        for event in self.events:
+            total = result.setdefault(event["name"], {"calls": 0, "seconds": 0.0, "allocated_blocks": 0, "gc_collections": 0})
+            total["calls"] += 1
+            for key in ["seconds", "allocated_blocks", "gc_collections"]: total[key] += event[key]
+            for key, value in event["counts"].items(): total[key] = total.get(key, 0) + value
+        return result
+
+    def report(self):
+        """Text table of summary(), the slowest phases first."""
+        lines = [f"{'phase':<28} {'calls':>6} {'seconds':>10} {'blocks':>10}  counts"]
+        for name, total in sorted(self.summary().items(), key=lambda item: -item[1]["seconds"]):
+            counts = " ".join(f"{key}={value}" for key, value in total.items() if key not in ("calls", "seconds", "allocated_blocks", "gc_collections"))
+            lines.append(f"{name:<28} {total['calls']:>6} {total['seconds']:>10.4f} {total['allocated_blocks']:>10}  {counts}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """The phases as a Chrome trace-event document (complete "X" events, times in microseconds)."""
+        pid, tid = os.getpid(), threading.get_ident()
+        events = [{"name": event["name"], "ph": "X", "pid": pid, "tid": tid,
+                   "ts": event["start"] * 1e6, "dur": event["seconds"] * 1e6,
+                   "args": dict(event["counts"], allocated_blocks=event["allocated_blocks"], gc_collections=event["gc_collections"])}
+                  for event in sorted(self.events, key=lambda event: (event["start"], event["depth"]))]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, filename):
+        with open(filename, "w") as f: json.dump(self.chrome_trace(), f)
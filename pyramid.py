@@ -0,0 +1,131 @@
+"""Level-of-detail pyramid: all levels 0..N of one subdivision run in one file.
+
+Every level is computed once from the one before by its stencil (see
+compact.Stencil), and the stencil also gives the maps between the levels: the
+new faces are sorted by the old element they come from, so the children of old
+face f are a range of faces of the next level (and so are the faces around old
+vertex v, after the old faces), and the new vertices come in blocks of one
+vertex per old vertex/edge/face/corner. The file is an .npz with the arrays of
+every level under its own names (positions_k, face_indices_k, face_offsets_k,
+children_k and vertex_blocks_k), coarse levels first. np.load reads an array
+only when it is used, so a viewer opens the pyramid, shows level 0 and reads
+the finer levels (or only the children of some faces) when it needs them.
+Every vertex position is stored once: the schemes move the old vertices too,
+so a level has no positions in common with the level before.
+
+How to use it?
+> pyramid = build(CompactMesh.from_file("best_meshes/bun.off"), "LOOP", 4)
+> pyramid.save("bun_lod.npz")
+> with load("bun_lod.npz") as pyramid:
+>     coarse = pyramid.mesh(0)
+>     faces = pyramid.children(1, [0, 1])     # faces of level 1 inside faces 0 and 1 of level 0
+or
+> python pyramid.py best_meshes/bun.off bun_lod.npz --scheme LOOP --levels 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import profiling
+from compact import CompactMesh, gather_faces
+
+
+class Pyramid:
+    """Levels of a subdivision; arrays: the named arrays of the file (a dict or an opened .npz)."""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.scheme = str(arrays["scheme"])
+        self.levels = int(arrays["levels"])
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exception): self.close()
+
+    def close(self):
+        if hasattr(self.arrays, "close"): self.arrays.close()
+
+    def mesh(self, level):
+        """CompactMesh of the level (0 is the control mesh)."""
+        return CompactMesh(*(self.arrays[f"{name}_{level}"] for name in ["positions", "face_indices", "face_offsets"]))
+
+    def children_offsets(self, level):
+        """Faces of the level coming from element e of the level before are children_offsets[e]:children_offsets[e + 1]
+        (e: old face, or old face_count + v for the faces around old vertex v)."""
+        return self.arrays[f"children_{level}"]
+
+    def children(self, level, faces):
+        """Faces of the level inside the faces of the level before, in order."""
+        offsets = self.children_offsets(level)
+        return gather_faces(np.arange(offsets[-1]), offsets, np.asarray(faces, dtype=np.int64).reshape(-1))[0]
+
+    def parents(self, level):
+        """Element of the level before every face of the level comes from (see children_offsets)."""
+        offsets = self.children_offsets(level)
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    def vertex_parents(self, level):
+        """(kind, element): the kind (compact.VERTEX, EDGE, FACE or CORNER) and the number of the element
+        of the level before that every vertex of the level comes from."""
+        blocks = self.arrays[f"vertex_blocks_{level}"]
+        kind = np.repeat(blocks[:, 0], blocks[:, 1])
+        starts = np.concatenate([[0], np.cumsum(blocks[:, 1])[:-1]])
+        return kind, np.arange(len(kind)) - np.repeat(starts, blocks[:, 1])
+
+    def save(self, filename):
+        """Write the pyramid (coarse levels first), under a temporary name renamed at the end."""
+        directory = os.path.dirname(os.path.abspath(filename))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(descriptor)
+        try:
+            with profiling.phase("pyramid.save"), open(temporary, "wb") as f:
+                np.savez(f, **{name: self.arrays[name] for name in self.arrays})
+            os.replace(temporary, filename)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+def build(mesh, algorithm="CC", levels=1, progress=None):
+    """Pyramid of levels 0..levels of mesh by the scheme (CC, DS, LOOP, PR or any in rules.py);
+    progress(level, levels) is called after every level."""
+    arrays = {"scheme": np.array(str(getattr(algorithm, "name", algorithm))), "levels": np.array(levels)}
+    arrays.update(positions_0=mesh.positions, face_indices_0=mesh.face_indices, face_offsets_0=mesh.face_offsets)
+    for k in range(1, levels + 1):
+        with profiling.phase(f"level {k}") as phase:
+            stencil = mesh.stencil(algorithm)
+            elements = mesh.face_count + mesh.vertex_count
+            arrays[f"children_{k}"] = np.searchsorted(stencil.face_major, np.arange(elements + 1))
+            arrays[f"vertex_blocks_{k}"] = np.array(stencil.blocks, dtype=np.int64).reshape(-1, 2)
+            mesh = mesh.refine(stencil)
+            arrays.update({f"positions_{k}": mesh.positions, f"face_indices_{k}": mesh.face_indices, f"face_offsets_{k}": mesh.face_offsets})
+            phase.count(vertices=mesh.vertex_count, faces=mesh.face_count)
+        if progress: progress(k, levels)
+    return Pyramid(arrays)
+
+
+def load(filename):
+    """Pyramid reading its arrays from the file when they are used (close it, or use it in a with block)."""
+    return Pyramid(np.load(filename))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write levels 0..N of a subdivision as one LOD pyramid (.npz).")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--scheme", default="CC", help="CC, DS, LOOP, PR, SQRT3 or any scheme registered in rules.py")
+    parser.add_argument("--levels", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    mesh = CompactMesh.from_file(args.input, triangular=args.scheme in ("LOOP", "SQRT3"))
+    pyramid = build(mesh, args.scheme, args.levels, lambda k, n: print(f"level {k}/{n}", file=sys.stderr))
+    pyramid.save(args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
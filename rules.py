@@ -0,0 +1,285 @@
+"""Subdivision schemes as declarative rules over the half-edge table of CompactMesh.
+
+A Scheme is a list of point rules and a list of face templates, and
+Scheme.stencil(mesh) turns them into the Stencil of the next level with
+whole-array operations only; no scheme has a loop of its own, so everything
+built on stencils (refine, parallel, adaptive, cache, hierarchy) works for every
+scheme, including new ones.
+
+Point rules give one block of new vertices per kind of old element:
+ - VertexRule: self * v + neighbours * (sum of the neighbours of v)
+   + faces * (sum of the centers of the faces around v), the weights are functions
+   of the arrays (neighbours count, faces count) of all vertices,
+ - EdgeRule: ends * (v1 + v2) + faces * (sum of the centers of its faces), separate
+   weights for inner and boundary edges,
+ - FaceRule: the face center,
+ - CornerRule: corner * v + prev * (previous vertex) + next * (next vertex)
+   + face * (center of the face).
+
+Face templates say which new vertices make every new face. A new vertex is named by
+(kind, reference): the new vertex of the old vertex/edge/face/corner of a half-edge
+given by reference (the origin vertex, the edge, the face or the half-edge itself):
+ - CornerFaces(elements): one face per corner c, references "" (c), "next", "prev",
+ - FaceFaces(element): one face per old face, element taken at every corner,
+ - EdgeFaces(elements, boundary=False): one face per inner (or boundary) edge,
+   references "origin" and "dest" (half-edges of the first face of the edge,
+   starting at its ends) and "twin_origin", "twin_dest" (the same for the second face),
+ - VertexFaces(kind, min_faces): one face per vertex with at least min_faces faces,
+   on its corners (CORNER) or edges (EDGE, the boundary edges of open rings
+   included) in one-ring order.
+
+How to use it?
+> mesh.stencil("CC") or schemes["CC"].stencil(mesh)
+> mesh.subdivide("SQRT3")
+> register(Scheme("MY", points=[...], faces=[...]))
+> mesh.subdivide("MY")
+"""
+
+import math
+
+import numpy as np
+import scipy.sparse as sparse
+
+from compact import VERTEX, EDGE, FACE, CORNER, Stencil, gather_faces, loop_alphas
+
+
+def at_least_one(count): return np.maximum(count, 1)
+
+
+class VertexRule:
+    def __init__(self, self_weight, neighbours=None, faces=None):
+        self.self_weight = self_weight
+        self.neighbours = neighbours
+        self.faces = faces
+
+    def matrix(self, mesh):
+        he = mesh.halfedges
+        n = mesh.vertex_count
+        adjacency = he.adjacency()
+        neighbours_count = np.diff(adjacency.indptr)
+        faces_count = np.bincount(he.origin, minlength=n)
+        matrix = sparse.diags(self.self_weight(neighbours_count, faces_count))
+        if self.neighbours:
+            matrix = matrix + sparse.diags(self.neighbours(neighbours_count, faces_count)) @ adjacency
+        if self.faces:
+            incidence = sparse.csr_matrix((np.ones(len(he)), (he.origin, he.face)), shape=(n, mesh.face_count))
+            matrix = matrix + sparse.diags(self.faces(neighbours_count, faces_count)) @ incidence @ mesh.centers_stencil()
+        return matrix
+
+
+class EdgeRule:
+    def __init__(self, inner, boundary):
+        """inner, boundary: (ends, faces) weights."""
+        self.inner = inner
+        self.boundary = boundary
+
+    def matrix(self, mesh):
+        he = mesh.halfedges
+        n, e, f = mesh.vertex_count, he.edge_count, mesh.face_count
+        first = he.edge_halfedge
+        second = he.twin[first]
+        inner = second >= 0
+        ends = np.where(inner, self.inner[0], self.boundary[0])
+        matrix = sparse.csr_matrix((np.repeat(ends, 2), (np.repeat(np.arange(e), 2), he.edge_vertices.ravel())), shape=(e, n))
+
+        faces = np.where(inner, self.inner[1], self.boundary[1])
+        both = np.flatnonzero(inner & (faces != 0))
+        rows = np.concatenate([np.flatnonzero(faces != 0), both])
+        if len(rows):
+            sides = sparse.csr_matrix((faces[rows], (rows, np.concatenate([he.face[first[faces != 0]], he.face[second[both]]]))), shape=(e, f))
+            matrix = matrix + sides @ mesh.centers_stencil()
+        return matrix
+
+
+class FaceRule:
+    def matrix(self, mesh): return mesh.centers_stencil()
+
+
+class CornerRule:
+    def __init__(self, corner, prev, next, face):
+        self.weights = corner, prev, next, face
+
+    def matrix(self, mesh):
+        he = mesh.halfedges
+        corner_weight, prev_weight, next_weight, face_weight = self.weights
+        corner = np.arange(len(he))
+        matrix = sparse.csr_matrix((np.repeat([[prev_weight, next_weight, corner_weight]], len(he), axis=0).ravel(), (np.repeat(corner, 3), np.stack([he.origin[he.prev], he.dest, he.origin], axis=1).ravel())), shape=(len(he), mesh.vertex_count))
+        if face_weight:
+            matrix = matrix + sparse.csr_matrix((np.full(len(he), face_weight), (corner, he.face)), shape=(len(he), mesh.face_count)) @ mesh.centers_stencil()
+        return matrix
+
+
+def element(he, kind, halfedge):
+    """Old element of the kind at every half-edge."""
+    return [he.origin, he.edge, he.face, None][kind][halfedge] if kind != CORNER else halfedge
+
+
+class CornerFaces:
+    def __init__(self, elements):
+        self.elements = elements
+
+    def faces(self, mesh, offsets):
+        he = mesh.halfedges
+        corner = np.arange(len(he))
+        step = {"": corner, "next": he.next, "prev": he.prev}
+        indices = np.stack([offsets[kind] + element(he, kind, step[reference]) for kind, reference in self.elements], axis=1)
+        return indices.ravel(), np.arange(0, indices.size + 1, len(self.elements)), he.face, corner
+
+
+class FaceFaces:
+    def __init__(self, element):
+        self.element = element
+
+    def faces(self, mesh, offsets):
+        he = mesh.halfedges
+        kind, reference = self.element
+        halfedge = {"": np.arange(len(he)), "next": he.next, "prev": he.prev}[reference]
+        f = mesh.face_count
+        return offsets[kind] + element(he, kind, halfedge), mesh.face_offsets, np.arange(f), np.full(f, -1)
+
+
+class EdgeFaces:
+    def __init__(self, elements, boundary=False):
+        self.elements = elements
+        self.boundary = boundary
+
+    def faces(self, mesh, offsets):
+        he = mesh.halfedges
+        first = he.edge_halfedge[he.boundary_edges == self.boundary]
+        second = he.twin[first]
+        same_direction = he.origin[second] == he.origin[first]
+        step = {"origin": first, "dest": he.next[first]}
+        if not self.boundary:
+            step.update(twin_origin=np.where(same_direction, second, he.next[second]), twin_dest=np.where(same_direction, he.next[second], second))
+        indices = np.stack([offsets[kind] + element(he, kind, step[reference]) for kind, reference in self.elements], axis=1)
+        return indices.ravel(), np.arange(0, indices.size + 1, len(self.elements)), he.face[first], first
+
+
+class VertexFaces:
+    def __init__(self, kind, min_faces):
+        self.kind = kind
+        self.min_faces = min_faces
+
+    def faces(self, mesh, offsets):
+        he = mesh.halfedges
+        ring_offsets, ring_corners, ring_flips, closed = he.vertex_rings()
+        ring_sizes = np.diff(ring_offsets)
+        if self.kind == CORNER:
+            vertices = np.flatnonzero(ring_sizes >= max(self.min_faces, 3))
+            indices, face_offsets = gather_faces(ring_corners, ring_offsets, vertices)
+        else:
+            # the edge between every two neighbouring faces of the ring, plus the
+            # first boundary edge for open rings
+            vertex = np.repeat(np.arange(mesh.vertex_count), ring_sizes)
+            opened = (ring_sizes > 0) & ~closed
+            counts = ring_sizes + opened
+            edge_offsets = np.concatenate([[0], np.cumsum(counts)])
+            opening = ring_offsets[:-1][opened]
+            edges = np.empty(edge_offsets[-1], dtype=np.int64)
+            edges[edge_offsets[:-1][opened]] = he.edge[np.where(ring_flips[opening], ring_corners[opening], he.prev[ring_corners[opening]])]
+            edges[np.arange(len(vertex)) + (edge_offsets[:-1] - ring_offsets[:-1] + opened)[vertex]] = he.edge[np.where(ring_flips, he.prev[ring_corners], ring_corners)]
+            vertices = np.flatnonzero((ring_sizes >= self.min_faces) & (counts >= 3))
+            indices, face_offsets = gather_faces(edges, edge_offsets, vertices)
+        return offsets[self.kind] + indices, face_offsets, mesh.face_count + vertices, np.full(len(vertices), -1)
+
+
+class Scheme:
+    def __init__(self, name, points, faces, creases=False):
+        """points: [(kind, rule)] in the order of the new vertex blocks, faces: templates,
+        creases: the vertex and edge points follow CompactMesh.crease_rules."""
+        self.name = name
+        self.points = points
+        self.faces = faces
+        self.creases = creases
+
+    def stencil(self, mesh):
+        he = mesh.halfedges
+        counts = {VERTEX: mesh.vertex_count, EDGE: he.edge_count, FACE: mesh.face_count, CORNER: len(he)}
+        blocks = [(kind, counts[kind]) for kind, _ in self.points]
+        matrices = {kind: rule.matrix(mesh) for kind, rule in self.points}
+
+        creases = None
+        if self.creases and mesh.creases is not None:
+            matrices[VERTEX], matrices[EDGE], creases = mesh.crease_rules(matrices[VERTEX], matrices[EDGE])
+
+        offsets = {}
+        start = 0
+        for kind, count in blocks:
+            offsets[kind] = start
+            start += count
+
+        parts = [template.faces(mesh, offsets) for template in self.faces]
+        indices = np.concatenate([part[0] for part in parts])
+        sizes = np.concatenate([np.diff(part[1]) for part in parts])
+        face_offsets = np.concatenate([[0], np.cumsum(sizes)])
+        major = np.concatenate([part[2] for part in parts])
+        minor = np.concatenate([part[3] for part in parts])
+        # faces of an old face (or vertex) together, like the object model
+        keys = major * (len(he) + 1) + minor
+        if np.any(keys[1:] < keys[:-1]):
+            order = np.argsort(keys, kind="stable")
+            (indices, face_offsets), major, minor = gather_faces(indices, face_offsets, order), major[order], minor[order]
+        matrix = sparse.vstack([matrices[kind] for kind, _ in self.points], format="csr")
+        return Stencil(matrix, indices, face_offsets, blocks, major, minor, creases)
+
+
+schemes = {}
+
+
+def register(scheme):
+    schemes[scheme.name] = scheme
+    return scheme
+
+
+# vertex points: (v*(n-3) + 2*esc + fsc)/n, esc = average of edge midpoints (v + v1)/2
+# over the neighbours, fsc = average of face points, n = number of faces; edge points:
+# (v1 + v2 + both face points)/4, (v1 + v2 + face point)/3 on the boundary;
+# one quad per corner, in the same order as Mesh.subdivision_CC
+register(Scheme("CC",
+    points=[(VERTEX, VertexRule(lambda m, k: (at_least_one(k) - 2) / at_least_one(k),
+                                neighbours=lambda m, k: 1 / (at_least_one(k) * at_least_one(m)),
+                                faces=lambda m, k: 1 / at_least_one(k)**2)),
+            (EDGE, EdgeRule(inner=(1/4, 1/4), boundary=(1/3, 1/3))),
+            (FACE, FaceRule())],
+    faces=[CornerFaces([(EDGE, ""), (VERTEX, "next"), (EDGE, "next"), (FACE, "")])],
+    creases=True))
+
+# one new vertex per corner: ((prev + next)/2 + 2*v + center)/4; face faces (starting at
+# the second corner, like Face.get_inside_points), edge faces on the corners of both faces
+# at the ends of every inner edge and vertex faces on the corners around every vertex
+register(Scheme("DS",
+    points=[(CORNER, CornerRule(corner=1/2, prev=1/8, next=1/8, face=1/4))],
+    faces=[FaceFaces((CORNER, "next")),
+           EdgeFaces([(CORNER, "dest"), (CORNER, "origin"), (CORNER, "twin_origin"), (CORNER, "twin_dest")]),
+           VertexFaces(CORNER, min_faces=3)]))
+
+# inner edge: (v1 + v2)/8 + 3/8 of both face centers (3/8 v1 + 3/8 v2 + 1/8 of the
+# opposite vertices for triangles), boundary edge: midpoint; per face the inner face
+# on its edge points, then one triangle per corner
+register(Scheme("LOOP",
+    points=[(VERTEX, VertexRule(lambda m, k: loop_alphas(m), neighbours=lambda m, k: (1 - loop_alphas(m)) / at_least_one(m))),
+            (EDGE, EdgeRule(inner=(1/8, 3/8), boundary=(1/2, 0)))],
+    faces=[FaceFaces((EDGE, "")), CornerFaces([(EDGE, ""), (VERTEX, "next"), (EDGE, "next")])]))
+
+# new vertices are the edge midpoints; face faces on the midpoints of their edges,
+# vertex faces on the edges around every vertex with at least 2 faces (chains of PR
+# levels take the faster path of peters_reif.py)
+register(Scheme("PR",
+    points=[(EDGE, EdgeRule(inner=(1/2, 0), boundary=(1/2, 0)))],
+    faces=[FaceFaces((EDGE, "")), VertexFaces(EDGE, min_faces=2)]))
+
+
+def sqrt3_alpha(valence):
+    return (4 - 2 * np.cos(2 * math.pi / at_least_one(valence))) / 9
+
+
+# Kobbelt's sqrt(3) subdivision of triangle meshes: a point in every face and the old
+# edges flipped, i.e. two triangles (end, face point, face point) per inner edge;
+# boundary vertices and edges stay (the triangle of a boundary edge keeps it)
+register(Scheme("SQRT3",
+    points=[(VERTEX, VertexRule(lambda m, k: np.where(m == k, 1 - sqrt3_alpha(m), 1.0),
+                                neighbours=lambda m, k: np.where(m == k, sqrt3_alpha(m) / at_least_one(m), 0.0))),
+            (FACE, FaceRule())],
+    faces=[EdgeFaces([(VERTEX, "origin"), (FACE, "twin_origin"), (FACE, "origin")]),
+           EdgeFaces([(VERTEX, "dest"), (FACE, "origin"), (FACE, "twin_origin")]),
+           EdgeFaces([(VERTEX, "origin"), (VERTEX, "dest"), (FACE, "origin")], boundary=True)]))
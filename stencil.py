@@ -0,0 +1,77 @@
+"""Precomputed subdivision operators.
+
+Subdividing a mesh is linear in its vertex positions, so for a fixed topology
+all levels of a scheme collapse into one sparse matrix. Build it once and reuse
+it for every set of positions (animation frames, morph targets):
+
+How to use it?
+> base = CompactMesh.from_file("best_meshes/m1600.off")
+> operator = subdivision_operator(base, "LOOP", 3)
+> mesh = operator.mesh(base.positions)                  # refined CompactMesh
+> frames = operator.apply(positions)                    # (N, 3) or (frames, N, 3)
+"""
+
+import collections
+import hashlib
+
+import numpy as np
+import scipy.sparse as sparse
+
+from compact import CompactMesh
+
+
+class SubdivisionOperator:
+    def __init__(self, mesh, algorithm, iterations_count):
+        if not isinstance(mesh, CompactMesh): mesh = CompactMesh.from_mesh(mesh)
+        self.algorithm = algorithm
+        self.iterations_count = iterations_count
+        self.input_count = mesh.vertex_count
+
+        matrix = sparse.identity(mesh.vertex_count, format="csr")
+        for i in range(iterations_count):
+            stencil = mesh.stencil(algorithm)
+            matrix = stencil.matrix @ matrix
+            mesh = mesh.refine(stencil)
+
+        self.matrix = matrix.tocsr()
+        self.face_indices = mesh.face_indices
+        self.face_offsets = mesh.face_offsets
+
+    @property
+    def output_count(self): return self.matrix.shape[0]
+
+    def apply(self, positions):
+        positions = np.asarray(positions, dtype=float)
+        if positions.shape[-2] != self.input_count:
+            raise Exception(f"operator expects {self.input_count} vertices, got {positions.shape[-2]}")
+        if positions.ndim == 2:
+            return self.matrix @ positions
+
+        # (frames, N, 3) -> (N, frames * 3), one product for the whole batch
+        frames = positions.shape[0]
+        result = self.matrix @ positions.transpose(1, 0, 2).reshape(self.input_count, -1)
+        return result.reshape(self.output_count, frames, -1).transpose(1, 0, 2)
+
+    def mesh(self, positions):
+        return CompactMesh(self.apply(positions), self.face_indices, self.face_offsets)
+
+
+_operators = collections.OrderedDict()
+cache_size = 16
+
+def subdivision_operator(mesh, algorithm, iterations_count):
+    """SubdivisionOperator for the mesh topology (and creases), reused while the same one is asked for again."""
+    if not isinstance(mesh, CompactMesh): mesh = CompactMesh.from_mesh(mesh)
+    data = mesh.face_indices.tobytes() + mesh.face_offsets.tobytes()
+    # the crease rules are part of the operator
+    if mesh.creases is not None: data += b"creases" + mesh.creases[0].tobytes() + mesh.creases[1].tobytes()
+    digest = hashlib.sha1(data).hexdigest()
+    key = (digest, mesh.vertex_count, algorithm, iterations_count)
+
+    if key in _operators:
+        _operators.move_to_end(key)
+        return _operators[key]
+
+    operator = _operators[key] = SubdivisionOperator(mesh, algorithm, iterations_count)
+    while len(_operators) > cache_size: _operators.popitem(last=False)
+    return operator
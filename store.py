@@ -0,0 +1,207 @@
+"""Directory-based mesh store for meshes bigger than memory.
+
+A store is a directory of raw .npy arrays (positions, face_indices,
+face_offsets and, once computed, the half-edge topology twin, edge and
+edge_halfedge) that are opened with np.memmap, so only the parts being worked
+on are in memory. Catmull-Clark reads level k and writes level k+1 chunk by
+chunk, deriving the topology of the new level from the old one without any
+global sort; the other schemes run in memory on the mapped arrays and write
+their result to the store.
+
+How to use it?
+> store = MeshStore.from_mesh("scan_0", CompactMesh.from_file("scan.off"))
+> store = store.subdivision("CC", "scan_1")
+> store.save("scan_smooth.off")
+"""
+
+import os
+
+import numpy as np
+
+import off
+from compact import CompactMesh
+
+chunk_size = 1 << 20
+
+arrays = ["positions", "face_indices", "face_offsets"]
+topology_arrays = ["twin", "edge", "edge_halfedge"]
+
+
+def chunks(count):
+    for start in range(0, count, chunk_size):
+        yield start, min(start + chunk_size, count)
+
+
+class MeshStore:
+    def __init__(self, directory, mode="r"):
+        self.directory = directory
+        self.mode = mode
+        for name in arrays:
+            setattr(self, name, np.load(self.path(name), mmap_mode=mode))
+
+    def path(self, name): return os.path.join(self.directory, name + ".npy")
+
+    @staticmethod
+    def create_array(directory, name, shape, dtype):
+        return np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+
+    @classmethod
+    def create(cls, directory, vertex_count, face_count, corner_count):
+        os.makedirs(directory, exist_ok=True)
+        # the topology of a store that was here before isn't the topology of the new one
+        for name in topology_arrays:
+            if os.path.exists(os.path.join(directory, name + ".npy")): os.remove(os.path.join(directory, name + ".npy"))
+        cls.create_array(directory, "positions", (vertex_count, 3), float)
+        cls.create_array(directory, "face_indices", (corner_count,), np.int64)
+        cls.create_array(directory, "face_offsets", (face_count + 1,), np.int64)
+        return cls(directory, "r+")
+
+    @classmethod
+    def from_mesh(cls, directory, mesh):
+        store = cls.create(directory, mesh.vertex_count, mesh.face_count, len(mesh.face_indices))
+        for start, end in chunks(mesh.vertex_count): store.positions[start:end] = mesh.positions[start:end]
+        for start, end in chunks(len(mesh.face_indices)): store.face_indices[start:end] = mesh.face_indices[start:end]
+        for start, end in chunks(mesh.face_count + 1): store.face_offsets[start:end] = mesh.face_offsets[start:end]
+        store.flush()
+        return store
+
+    def to_mesh(self):
+        return CompactMesh(self.positions, self.face_indices, self.face_offsets)
+
+    def flush(self):
+        for name in arrays:
+            getattr(self, name).flush()
+
+    def save(self, filename, binary=False, decimals=None):
+        off.write_mesh(filename, self.positions, self.face_indices, self.face_offsets, binary, decimals)
+
+    @property
+    def vertex_count(self): return len(self.positions)
+
+    @property
+    def face_count(self): return len(self.face_offsets) - 1
+
+    def topology(self):
+        """(twin, edge, edge_halfedge) arrays, computed in memory (and stored) if the store has none."""
+        if not all(os.path.exists(self.path(name)) for name in topology_arrays):
+            he = self.to_mesh().halfedges
+            for name in topology_arrays:
+                np.save(self.path(name), getattr(he, name))
+        return [np.load(self.path(name), mmap_mode="r") for name in topology_arrays]
+
+    # face, next, prev of a range of half-edges, from the face offsets only
+
+    def corners_face(self, corners):
+        return np.searchsorted(self.face_offsets, corners, side="right") - 1
+
+    def corners_next(self, corners, face):
+        return np.where(corners + 1 == self.face_offsets[face + 1], self.face_offsets[face], corners + 1)
+
+    def corners_prev(self, corners, face):
+        return np.where(corners == self.face_offsets[face], self.face_offsets[face + 1] - 1, corners - 1)
+
+    def subdivision(self, algorithm, directory):
+        if algorithm == "CC": return self.subdivision_CC(directory)
+        return MeshStore.from_mesh(directory, getattr(self.to_mesh(), "subdivision_" + algorithm)())
+
+    def subdivision_CC(self, directory):
+        twin, edge, edge_halfedge = self.topology()
+        n, e, f, h = self.vertex_count, len(edge_halfedge), self.face_count, len(self.face_indices)
+        positions, face_indices, face_offsets = self.positions, self.face_indices, self.face_offsets
+        result = MeshStore.create(directory, n + e + f, h, 4 * h)
+        face_points = result.positions[n + e:]
+
+        for start, end in chunks(f):
+            offsets = face_offsets[start:end + 1]
+            sums = np.add.reduceat(positions[face_indices[offsets[0]:offsets[-1]]], offsets[:-1] - offsets[0], axis=0)
+            face_points[start:end] = sums / np.diff(offsets)[:, None]
+
+        # edge points, and neighbours of every vertex for the vertex points
+        neighbours_count = MeshStore.create_array(directory, "neighbours_count", (n,), np.int64)
+        neighbours = MeshStore.create_array(directory, "neighbours", (n, 3), float)
+        neighbours_count[:] = 0
+        neighbours[:] = 0
+        for start, end in chunks(e):
+            first = np.asarray(edge_halfedge[start:end])
+            face = self.corners_face(first)
+            a, b = face_indices[first], face_indices[self.corners_next(first, face)]
+            second = twin[first]
+            inner = second >= 0
+            points = positions[a] + positions[b] + face_points[face]
+            points[inner] += face_points[self.corners_face(second[inner])]
+            result.positions[n + start:n + end] = points / np.where(inner, 4, 3)[:, None]
+            np.add.at(neighbours_count, a, 1)
+            np.add.at(neighbours_count, b, 1)
+            np.add.at(neighbours, a, positions[b])
+            np.add.at(neighbours, b, positions[a])
+
+        # vertex points: (v*(n-3) + 2*esc + fsc)/n
+        faces_count = MeshStore.create_array(directory, "faces_count", (n,), np.int64)
+        face_sums = MeshStore.create_array(directory, "face_sums", (n, 3), float)
+        faces_count[:] = 0
+        face_sums[:] = 0
+        for start, end in chunks(h):
+            corners = np.arange(start, end)
+            origin = face_indices[start:end]
+            np.add.at(faces_count, origin, 1)
+            np.add.at(face_sums, origin, face_points[self.corners_face(corners)])
+        for start, end in chunks(n):
+            count = np.maximum(faces_count[start:end], 1)[:, None]
+            esc = (positions[start:end] + neighbours[start:end] / np.maximum(neighbours_count[start:end], 1)[:, None]) / 2
+            result.positions[start:end] = (positions[start:end] * (count - 3) + esc * 2 + face_sums[start:end] / count) / count
+        del neighbours_count, neighbours, faces_count, face_sums
+        for name in ["neighbours_count", "neighbours", "faces_count", "face_sums"]:
+            os.remove(os.path.join(directory, name + ".npy"))
+
+        # one quad per corner (like CompactMesh.stencil_CC), and the topology of the new
+        # level: quad c has corners 4c (edge point -> vertex point), 4c+1 (vertex point ->
+        # next edge point), 4c+2 (next edge point -> face point), 4c+3 (face point -> edge point)
+        new_twin = MeshStore.create_array(directory, "twin", (4 * h,), np.int64)
+        new_edge = MeshStore.create_array(directory, "edge", (4 * h,), np.int64)
+        edges_done = 0
+        for start, end in chunks(h):
+            corners = np.arange(start, end)
+            face = self.corners_face(corners)
+            following = self.corners_next(corners, face)
+            previous = self.corners_prev(corners, face)
+            origin, dest = face_indices[start:end], face_indices[following]
+
+            result.face_indices[4 * start:4 * end] = np.stack([n + edge[start:end], dest, n + edge[following], n + e + face], axis=1).ravel()
+            result.face_offsets[start:end] = 4 * corners
+
+            # halves of a split edge meet the quads of the twin face: the same or the
+            # neighbouring corner of it, depending on the twin's direction
+            t = twin[start:end]
+            t_face = self.corners_face(np.maximum(t, 0))
+            t_opposite = face_indices[np.maximum(t, 0)] == dest
+            first_half = np.where(t_opposite, 4 * self.corners_prev(np.maximum(t, 0), t_face) + 1, 4 * t)
+            u = twin[following]
+            u_face = self.corners_face(np.maximum(u, 0))
+            u_opposite = face_indices[np.maximum(u, 0)] != dest
+            second_half = np.where(u_opposite, 4 * u, 4 * self.corners_prev(np.maximum(u, 0), u_face) + 1)
+            twins = np.stack([np.where(t >= 0, first_half, -1), np.where(u >= 0, second_half, -1), 4 * following + 3, 4 * previous + 2], axis=1).ravel()
+            new_twin[4 * start:4 * end] = twins
+
+            # edges are numbered in order of their first half-edge (like HalfEdges)
+            children = np.arange(4 * start, 4 * end)
+            primary = (twins < 0) | (children < twins)
+            new_edge[4 * start:4 * end][primary] = edges_done + np.arange(np.count_nonzero(primary))
+            edges_done += np.count_nonzero(primary)
+        result.face_offsets[h] = 4 * h
+
+        # first half-edge of every edge, in the same order (written chunk by chunk too)
+        new_edge_halfedge = MeshStore.create_array(directory, "edge_halfedge", (int(edges_done),), np.int64)
+        edges_done = 0
+        for start, end in chunks(4 * h):
+            twins = new_twin[start:end]
+            children = np.arange(start, end)
+            secondary = (twins >= 0) & (children > twins)
+            new_edge[start:end][secondary] = new_edge[twins[secondary]]
+            primary = children[~secondary]
+            new_edge_halfedge[edges_done:edges_done + len(primary)] = primary
+            edges_done += len(primary)
+        new_edge_halfedge.flush()
+        new_twin.flush()
+        new_edge.flush()
+        result.flush()
+        return result
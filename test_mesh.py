@@ -0,0 +1,31 @@
+import numpy as np
+
+from compact import CompactMesh
+from mesh import Face, Mesh, Vertex
+
+
+def tetrahedron():
+    vertices = [Vertex(0, 0, 0), Vertex(1, 0, 0), Vertex(0, 1, 0), Vertex(0, 0, 1)]
+    faces = [Face([vertices[i] for i in face]) for face in [[0, 2, 1], [0, 1, 3], [1, 2, 3], [0, 3, 2]]]
+    return Mesh(vertices=vertices, faces=faces)
+
+
+def test_hand_built_mesh_round_trip(tmp_path):
+    positions, face_indices, face_offsets = tetrahedron().to_arrays()
+    assert face_indices.tolist() == [0, 2, 1, 0, 1, 3, 1, 2, 3, 0, 3, 2]
+    assert np.array_equal(face_offsets, [0, 3, 6, 9, 12])
+
+    tetrahedron().save(str(tmp_path / "tetrahedron.off"))
+    loaded = CompactMesh.from_file(str(tmp_path / "tetrahedron.off"))
+    assert np.array_equal(loaded.positions, positions)
+    assert np.array_equal(loaded.face_indices, face_indices)
+    assert CompactMesh.from_mesh(tetrahedron()).faces() == [[0, 2, 1], [0, 1, 3], [1, 2, 3], [0, 3, 2]]
+
+
+def test_hand_built_mesh_subdivides_like_compact():
+    for scheme in ["CC", "DS", "LOOP", "PR"]:
+        result = getattr(tetrahedron(), "subdivision_" + scheme)()
+        expected = CompactMesh.from_mesh(tetrahedron()).subdivide(scheme)
+        positions, face_indices, face_offsets = result.to_arrays()
+        assert np.allclose(positions, expected.positions)
+        assert np.array_equal(face_indices, expected.face_indices)
@@ -4,15 +4,24 @@ from tkinter import messagebox
 
 dark_blue = '#374956'
 white = "#f4f4f5"
-window_width = 500
-window_height = 300
+window_width = 600
+window_height = 400
 algorithm_names = ["CathmulClark", "DooSabin", "Loop", "PetersReif", "Mixed"]
 
-app = Tk()
-app.configure(bg=dark_blue)
 font_size = int(window_height / 25)
-normal_font = Font(family="Open Sans", size=font_size)
-bigger_font = Font(family="Open Sans", size=int(font_size * 3 / 2))
+app = None
+normal_font = None
+bigger_font = None
+
+def create_app():
+    """The Tk root window, created on the first call (importing this module, e.g. again in a spawned worker, opens nothing)."""
+    global app, normal_font, bigger_font
+    if app is None:
+        app = Tk()
+        app.configure(bg=dark_blue)
+        normal_font = Font(family="Open Sans", size=font_size)
+        bigger_font = Font(family="Open Sans", size=int(font_size * 3 / 2))
+    return app
 
 def set_width(scale):
     return int(window_width * scale)
@@ -0,0 +1,168 @@
+"""Validation and repair of mesh topology before subdivision.
+
+check() finds, with whole-array operations over the edge table of the mesh (the
+HalfEdges of CompactMesh), everything the subdivision schemes would otherwise
+trip over later: faces with repeated corners or less than 3 different
+vertices, duplicate faces, non-manifold edges (more than 2 faces) and vertices
+(more than one fan of faces), edges whose two faces are wound in opposite
+directions, boundary edges and isolated vertices. repair() removes the repeated
+corners, degenerate and duplicate faces and isolated vertices and orients every
+connected part consistently (flipping as few faces as possible); non-manifold
+parts and boundaries are only reported.
+
+How to use it?
+> report = check(CompactMesh.from_file("scan.off"))
+> print(report)
+> mesh, report = repair(CompactMesh(*off.read_mesh("scan.off")))
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse import csgraph
+
+from compact import CompactMesh, gather_faces
+
+
+class Report:
+    """Problems of a mesh: numbers of the faces/edges/vertices with every problem (edges as vertex pairs)."""
+
+    fields = ["repeated_corners", "degenerate_faces", "duplicate_faces", "non_manifold_edges", "non_manifold_vertices",
+              "inconsistent_edges", "non_orientable_faces", "isolated_vertices", "boundary_edges"]
+    # boundaries are fine for the schemes
+    problems = fields[:-1]
+
+    def __init__(self, **found):
+        for name in self.fields: setattr(self, name, found.get(name, np.zeros(0, dtype=np.int64)))
+        self.fixed = []
+
+    @property
+    def ok(self):
+        return all(len(getattr(self, name)) == 0 for name in self.problems)
+
+    @property
+    def remaining(self):
+        """Problems still in the mesh after repair() (all of them for a check() report)."""
+        return [name for name in self.problems if len(getattr(self, name)) and name not in self.fixed]
+
+    def __str__(self):
+        lines = [f"{name.replace('_', ' ')}: {len(getattr(self, name))}" + (" (fixed)" if name in self.fixed else "")
+                 for name in self.fields if len(getattr(self, name))]
+        return "\n".join(lines) if lines else "no problems"
+
+
+def next_corners(face_offsets):
+    sizes = np.diff(face_offsets)
+    index = np.arange(face_offsets[-1])
+    end = np.repeat(face_offsets[1:], sizes)
+    return np.where(index + 1 == end, np.repeat(face_offsets[:-1], sizes), index + 1)
+
+
+def repeated_corners(mesh):
+    """Corners equal to the next corner of their face."""
+    return np.flatnonzero(mesh.face_indices == mesh.face_indices[next_corners(mesh.face_offsets)])
+
+
+def degenerate_faces(mesh):
+    """Faces with a vertex more than once (after removing repeated corners) or less than 3 different vertices."""
+    face = np.repeat(np.arange(mesh.face_count), mesh.face_sizes)
+    keys = np.sort(face * mesh.vertex_count + mesh.face_indices)
+    distinct = np.bincount(np.unique(keys) // max(mesh.vertex_count, 1), minlength=mesh.face_count)
+    corners = mesh.face_sizes - np.bincount(face[repeated_corners(mesh)], minlength=mesh.face_count)
+    return np.flatnonzero((distinct < 3) | (distinct < corners))
+
+
+def duplicate_faces(mesh):
+    """Faces with the same vertices as an earlier face."""
+    result = []
+    sizes = mesh.face_sizes
+    for size in np.unique(sizes):
+        faces = np.flatnonzero(sizes == size)
+        rows = np.sort(mesh.face_indices[mesh.face_offsets[faces][:, None] + np.arange(size)], axis=1)
+        _, first = np.unique(rows, axis=0, return_index=True)
+        repeated = np.ones(len(faces), dtype=bool)
+        repeated[first] = False
+        result.append(faces[repeated])
+    return np.sort(np.concatenate(result)) if result else np.zeros(0, dtype=np.int64)
+
+
+def orientation(mesh):
+    """(flip, non_orientable): faces to reverse so that every manifold edge is used in both directions,
+    as few as possible in every connected part, and the faces of parts that can't be oriented."""
+    he = mesh.halfedges
+    f = mesh.face_count
+    first = he.edge_halfedge[he.edge_faces_count == 2]
+    second = he.twin[first]
+    a, b = he.face[first], he.face[second]
+    same = he.origin[first] == he.origin[second]
+
+    # node 2f + o is face f kept (o = 0) or flipped (o = 1): neighbours with the same
+    # direction of their edge need opposite states
+    rows = np.concatenate([2 * a, 2 * a + 1])
+    cols = np.concatenate([2 * b + same, 2 * b + 1 - same])
+    graph = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(2 * f, 2 * f))
+    _, labels = csgraph.connected_components(graph, directed=False)
+    kept, flipped = labels[0::2], labels[1::2]
+
+    non_orientable = kept == flipped
+    flip = kept > flipped
+    # flip the smaller half of every part
+    part = np.minimum(kept, flipped)
+    flips = np.bincount(part, weights=flip, minlength=2 * f)
+    total = np.bincount(part, minlength=2 * f)
+    flip ^= 2 * flips[part] > total[part]
+    flip &= ~non_orientable
+    return flip, np.flatnonzero(non_orientable)
+
+
+def check(mesh):
+    """Report of all problems of a CompactMesh."""
+    he = mesh.halfedges
+    inner = he.edge_halfedge[he.edge_faces_count == 2]
+    valence = np.bincount(he.origin, minlength=mesh.vertex_count)
+    ring_offsets, _, _, _ = he.vertex_rings()
+    _, non_orientable = orientation(mesh)
+    return Report(
+        repeated_corners=repeated_corners(mesh),
+        degenerate_faces=degenerate_faces(mesh),
+        duplicate_faces=duplicate_faces(mesh),
+        non_manifold_edges=he.edge_vertices[he.edge_faces_count > 2],
+        non_manifold_vertices=np.flatnonzero(np.diff(ring_offsets) < valence),
+        inconsistent_edges=he.edge_vertices[he.edge[inner[he.origin[inner] == he.origin[he.twin[inner]]]]],
+        non_orientable_faces=non_orientable,
+        isolated_vertices=np.flatnonzero(valence == 0),
+        boundary_edges=he.edge_vertices[he.boundary_edges],
+    )
+
+
+def flip_faces(mesh, flip):
+    """Mesh with the corners of the flip faces in reverse order (starting at the same corner)."""
+    sizes = mesh.face_sizes
+    face = np.repeat(np.arange(mesh.face_count), sizes)
+    local = np.arange(len(mesh.face_indices)) - mesh.face_offsets[face]
+    source = mesh.face_offsets[face] + np.where(flip[face], (sizes[face] - local) % sizes[face], local)
+    return CompactMesh(mesh.positions, mesh.face_indices[source], mesh.face_offsets, mesh.creases)
+
+
+def repair(mesh):
+    """(repaired CompactMesh, Report of the problems of mesh) - fixes what can be fixed without guessing."""
+    report = check(mesh)
+
+    keep = np.ones(len(mesh.face_indices), dtype=bool)
+    keep[report.repeated_corners] = False
+    face = np.repeat(np.arange(mesh.face_count), mesh.face_sizes)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(face[keep], minlength=mesh.face_count))])
+    mesh = CompactMesh(mesh.positions, mesh.face_indices[keep], offsets, mesh.creases)
+
+    valid = np.ones(mesh.face_count, dtype=bool)
+    valid[degenerate_faces(mesh)] = False
+    valid[duplicate_faces(mesh)] = False
+    mesh = CompactMesh(mesh.positions, *gather_faces(mesh.face_indices, mesh.face_offsets, np.flatnonzero(valid)), mesh.creases)
+
+    flip, _ = orientation(mesh)
+    if flip.any(): mesh = flip_faces(mesh, flip)
+    mesh = mesh.cleanup()
+
+    report.fixed = [name for name in ["repeated_corners", "degenerate_faces", "duplicate_faces", "inconsistent_edges", "isolated_vertices"]
+                    if len(getattr(report, name))]
+    if len(report.non_orientable_faces) and "inconsistent_edges" in report.fixed: report.fixed.remove("inconsistent_edges")
+    return mesh, report